@@ -25,7 +25,7 @@ export PATH_TRAIN=${PREFIX}/train.csv.gz
 export PATH_EVAL=${PREFIX}/eval.csv.gz
 ## serve service
 # path to the model object(s)/file(s)
-export PATH_MODEL=${MODEL_VER}/${PREFIX}/model.pkl
+export PATH_MODEL=${MODEL_VER}/${PREFIX}/model.json
 # bucket to the data set for prediction
 export BUCKET_DATA_PREDICT=${BASE_DIR}/bucket/data/predict
 # path to the intup data set for prediction
@@ -1,40 +1,513 @@
 # Dmitry Kisler © 2019
 # www.dkisler.com
 
+import os
+import io
+import gzip
+import json
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+import pyarrow.ipc as ipc
 import pickle
-from typing import Tuple
+from typing import Tuple, Iterator, Iterable, Union, List
 
 
-def load_data(path: str) -> Tuple[pd.DataFrame, str]:
+# attributes selected into the features_v1 data set
+ATTRIBUTES_V1 = [5, 27, 2, 34, 29, 30, 9, 7, 142, 11]
+
+# data sets columns with their compact dtypes
+SCHEMAS = {
+    "features_v1": {
+        "cr": "float32",
+        "entity_id": "int64",
+        "computer": "int8",
+        "smartphone": "int8",
+        "attrs_scale": "float32",
+        **{f"att{i}": "int8" for i in ATTRIBUTES_V1}
+    },
+    "raw": {
+        "entity_id": "int64",
+        **{f"att{i}": "int8" for i in range(1, 161)},
+        "device": "category",
+        "week": "int16",
+        "Clicks": "int32",
+        "Conversions": "int32"
+    }
+}
+
+
+# data formats by file extensions, csv is used for any other extension
+FORMATS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+    ".ipc": "feather"
+}
+
+# schema metadata key with the categories of the categorical columns,
+# parquet stores the categories of the columns with rows only
+CATEGORIES_KEY = b"categories"
+
+
+def get_data_format(path: str,
+                    data_format: str = None) -> str:
+    """Function to define the data file format
+
+       Args:
+          path: path to data
+          data_format: format to enforce, one of csv, parquet, feather
+
+       Returns:
+          data format name
+
+       Raises:
+          ValueError, unknown data format
+    """
+    if data_format is None:
+        return FORMATS.get(os.path.splitext(path)[1].lower(), "csv")
+    if data_format not in ("csv", "parquet", "feather"):
+        raise ValueError(f"Unknown data format '{data_format}'. Available formats: csv, parquet, feather")
+    return data_format
+
+
+def _get_columns(path: str,
+                 data_format: str) -> List[str]:
+    """Function to read the data columns names
+
+       Args:
+          path: path to data
+          data_format: data format name
+
+       Returns:
+          list of columns
+    """
+    if data_format == "parquet":
+        return pq.ParquetFile(path).schema_arrow.names
+    if data_format == "feather":
+        return ipc.open_file(pa.memory_map(path)).schema.names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def _schema_options(path: str,
+                    data_format: str,
+                    schema: Union[str, dict] = None,
+                    usecols: List[str] = None) -> Tuple[List[str], dict]:
+    """Function to define columns to read and their dtypes according to the data schema
+
+       Args:
+          path: path to data
+          data_format: data format name
+          schema: built-in schema name from SCHEMAS, or dict with columns dtypes
+          usecols: list of columns to read, all schema columns are read by default
+
+       Returns:
+          tuple with the list of columns to read and the dict with columns dtypes
+
+       Raises:
+          ValueError, the data columns don't match the schema
+    """
+    if schema is None:
+        return usecols, None
+
+    if isinstance(schema, str):
+        if schema not in SCHEMAS:
+            raise ValueError(f"Unknown schema '{schema}'. Available schemas: {', '.join(SCHEMAS)}")
+        schema = SCHEMAS[schema]
+
+    columns = _get_columns(path, data_format)
+    unexpected = [i for i in columns if i not in schema]
+    if unexpected:
+        raise ValueError(f"Unexpected columns: {', '.join(unexpected)}")
+
+    if usecols is None:
+        usecols = columns
+    missing = [i for i in usecols if i not in columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+    return usecols, {i: schema[i] for i in usecols}
+
+
+def _to_pandas(table: pa.Table,
+               dtype: dict = None) -> pd.DataFrame:
+    """Function to convert arrow table to DataFrame
+
+       Args:
+          table: arrow table
+          dtype: dict with columns dtypes
+
+       Returns:
+          data set DataFrame
+    """
+    df = table.to_pandas()
+    # the categories of the columns without rows
+    categories = json.loads((table.schema.metadata or {}).get(CATEGORIES_KEY, b"{}"))
+    for column, values in categories.items():
+        if column in df.columns and isinstance(df[column].dtype, pd.CategoricalDtype) \
+                and df[column].cat.categories.empty:
+            df[column] = df[column].cat.set_categories(values)
+    if dtype:
+        df = df.astype(dtype, copy=False)
+    return df
+
+
+def _from_pandas(df: pd.DataFrame) -> pa.Table:
+    """Function to convert DataFrame to arrow table
+
+       The categories of the categorical columns are stored in the schema metadata
+       to restore the dtypes of the data set without rows, see _to_pandas.
+
+       Args:
+          df: data set DataFrame
+
+       Returns:
+          arrow table
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    categories = {column: df[column].cat.categories.tolist()
+                  for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)}
+    if not categories:
+        return table
+    return table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                          CATEGORIES_KEY: json.dumps(categories).encode()})
+
+
+def _write_table(writer: Union[pq.ParquetWriter, ipc.RecordBatchFileWriter],
+                 table: pa.Table):
+    """Function to write arrow table into the parquet, or arrow file
+
+       The arrow file writer skips the record batches without rows, hence the table without rows
+       is written as an empty record batch for the file to store the columns dictionaries.
+
+       Args:
+          writer: parquet, or arrow file writer
+          table: arrow table
+    """
+    if table.num_rows or isinstance(writer, pq.ParquetWriter):
+        writer.write_table(table)
+    else:
+        writer.write_batch(pa.RecordBatch.from_arrays([i.combine_chunks() for i in table.columns],
+                                                      schema=table.schema))
+
+
+def _read_table(path: str,
+                data_format: str,
+                usecols: List[str] = None) -> pa.Table:
+    """Function to read columnar data file as arrow table
+
+       Feather files are memory-mapped, hence uncompressed files are read zero-copy.
+
+       Args:
+          path: path to data
+          data_format: data format name, parquet, or feather
+          usecols: list of columns to read
+
+       Returns:
+          arrow table
+    """
+    if data_format == "feather":
+        return feather.read_table(path, columns=usecols, memory_map=True)
+    return pq.read_table(path, columns=usecols, memory_map=True)
+
+
+def load_data(path: str,
+              schema: Union[str, dict] = None,
+              usecols: List[str] = None,
+              data_format: str = None) -> Tuple[pd.DataFrame, str]:
     """Function to load data set for prediction
 
        Args:
           path: path to data
+          schema: built-in schema name from SCHEMAS, or dict with columns dtypes
+          usecols: list of columns to read
+          data_format: format to enforce, the format is defined by the file extension by default
 
        Returns:
           tuple with the data set DataFrame and error string
     """
     try:
-        df = pd.read_csv(path)
+        data_format = get_data_format(path, data_format)
+        usecols, dtype = _schema_options(path, data_format, schema, usecols)
+        if data_format == "csv":
+            df = pd.read_csv(path, usecols=usecols, dtype=dtype)
+        else:
+            df = _to_pandas(_read_table(path, data_format, usecols), dtype)
         return df, None
     except Exception as ex:
         return None, ex
 
 
-def save_data(df: pd.DataFrame, path: str):
+def load_data_chunks(path: str,
+                     chunk_rows: int,
+                     schema: Union[str, dict] = None,
+                     usecols: List[str] = None,
+                     data_format: str = None) -> Tuple[Iterator[pd.DataFrame], str]:
+    """Function to load data set for prediction as a stream of chunks
+
+       Args:
+          path: path to data
+          chunk_rows: number of rows per chunk
+          schema: built-in schema name from SCHEMAS, or dict with columns dtypes
+          usecols: list of columns to read
+          data_format: format to enforce, the format is defined by the file extension by default
+
+       Returns:
+          tuple with the iterator over data set DataFrame chunks and error string
+    """
+    try:
+        data_format = get_data_format(path, data_format)
+        usecols, dtype = _schema_options(path, data_format, schema, usecols)
+        if data_format == "csv":
+            chunks = pd.read_csv(path,
+                                 chunksize=chunk_rows,
+                                 usecols=usecols,
+                                 dtype=dtype)
+        elif data_format == "parquet":
+            chunks = (_to_pandas(pa.Table.from_batches([batch]), dtype)
+                      for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows,
+                                                                     columns=usecols))
+        else:
+            table = _read_table(path, data_format, usecols)
+            chunks = (_to_pandas(table.slice(i, chunk_rows), dtype)
+                      for i in range(0, table.num_rows, chunk_rows))
+        return chunks, None
+    except Exception as ex:
+        return None, ex
+
+
+def _read_parquet_range(path: str,
+                        start: int,
+                        rows: int,
+                        usecols: List[str] = None) -> pa.Table:
+    """Function to read a range of rows from the row groups of the parquet file
+
+       Args:
+          path: path to data
+          start: index of the first row to read
+          rows: number of rows to read
+          usecols: list of columns to read
+
+       Returns:
+          arrow table
+    """
+    f = pq.ParquetFile(path)
+    groups, offset, first = [], 0, start
+    for i in range(f.metadata.num_row_groups):
+        group_rows = f.metadata.row_group(i).num_rows
+        if offset + group_rows > start and offset < start + rows:
+            if not groups:
+                first = offset
+            groups.append(i)
+        offset += group_rows
+    return f.read_row_groups(groups, columns=usecols).slice(start - first, rows)
+
+
+def _skip_lines(f: io.BufferedIOBase,
+                lines: int):
+    """Function to move the binary stream past the lines
+
+       The line ends are counted in the buffered blocks of bytes,
+       the lines are not split, nor parsed.
+
+       Args:
+          f: binary stream
+          lines: number of lines to skip
+    """
+    while lines > 0:
+        block = f.peek(1 << 16)
+        if not block:
+            return
+        found = block.count(b'\n')
+        if found < lines:
+            f.read(len(block))
+            lines -= found
+            continue
+        end = -1
+        for _ in range(lines):
+            end = block.index(b'\n', end + 1)
+        f.read(end + 1)
+        return
+
+
+def load_data_range(path: str,
+                    start: int,
+                    rows: int,
+                    schema: Union[str, dict] = None,
+                    usecols: List[str] = None,
+                    data_format: str = None) -> Tuple[pd.DataFrame, str]:
+    """Function to load a range of rows of the data set for prediction
+
+       Args:
+          path: path to data
+          start: index of the first data row to read (header excluded)
+          rows: number of rows to read
+          schema: built-in schema name from SCHEMAS, or dict with columns dtypes
+          usecols: list of columns to read
+          data_format: format to enforce, the format is defined by the file extension by default
+
+       Returns:
+          tuple with the data set DataFrame and error string
+    """
+    try:
+        data_format = get_data_format(path, data_format)
+        usecols, dtype = _schema_options(path, data_format, schema, usecols)
+        if data_format == "csv":
+            columns = _get_columns(path, data_format)
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rb') as f:
+                # the header and the rows before the range are skipped by the byte offset, not parsed
+                _skip_lines(f, start + 1)
+                df = pd.read_csv(f,
+                                 header=None,
+                                 names=columns,
+                                 nrows=rows,
+                                 usecols=usecols,
+                                 dtype=dtype)
+        elif data_format == "parquet":
+            df = _to_pandas(_read_parquet_range(path, start, rows, usecols), dtype)
+        else:
+            df = _to_pandas(_read_table(path, data_format, usecols).slice(start, rows), dtype)
+        return df, None
+    except Exception as ex:
+        return None, ex
+
+
+def count_rows(path: str,
+               data_format: str = None) -> Tuple[int, str]:
+    """Function to count data rows in the data file
+
+       Args:
+          path: path to data
+          data_format: format to enforce, the format is defined by the file extension by default
+
+       Returns:
+          tuple with the number of data rows (header excluded) and error string
+    """
+    try:
+        data_format = get_data_format(path, data_format)
+        if data_format == "parquet":
+            return pq.ParquetFile(path).metadata.num_rows, None
+        if data_format == "feather":
+            return _read_table(path, data_format).num_rows, None
+
+        opener = gzip.open if path.endswith('.gz') else open
+        lines, last = 0, b'\n'
+        with opener(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                lines += block.count(b'\n')
+                last = block[-1:]
+    except Exception as ex:
+        return None, ex
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0), None
+
+
+def _open_gzip(path: str) -> io.TextIOWrapper:
+    """Function to open gzip text stream to write csv into
+
+       The gzip header timestamp is fixed to make the output
+       reproducible regardless of the number of writes into the stream.
+
+       Args:
+          path: path to store data into
+
+       Returns:
+          text stream object
+    """
+    return io.TextIOWrapper(gzip.GzipFile(path, mode='wb', mtime=0),
+                            encoding='utf-8',
+                            newline='')
+
+
+def save_data(df: pd.DataFrame,
+              path: str,
+              data_format: str = None):
     """Function to save model predictions
 
+       Feather files are stored uncompressed to be memory-mapped on read.
+
        Args:
           df: data set with prediction results
           path: path to store data into
+          data_format: format to enforce, the format is defined by the file extension by default
     """
     try:
-        df.to_csv(path,
-                  compression='gzip',
-                  index=False)
+        data_format = get_data_format(path, data_format)
+        if data_format == "parquet":
+            pq.write_table(_from_pandas(df), path)
+        elif data_format == "feather":
+            table = _from_pandas(df)
+            if table.num_rows:
+                feather.write_feather(table, path,
+                                      compression='uncompressed')
+            else:
+                with ipc.new_file(path, table.schema) as writer:
+                    _write_table(writer, table)
+        else:
+            with _open_gzip(path) as f:
+                df.to_csv(f, index=False)
+    except IOError as ex:
+        raise ex
+
+
+def save_data_chunks(chunks: Iterable[pd.DataFrame],
+                     path: str,
+                     data_format: str = None,
+                     empty: pd.DataFrame = None) -> int:
+    """Function to save model predictions streamed by chunks into a single file
+
+       The output is identical to the output of save_data
+       for the concatenated chunks in case of csv.
+       Every chunk is stored as a parquet row group, or an arrow record batch.
+
+       Args:
+          chunks: iterable with data set chunks with prediction results
+          path: path to store data into
+          data_format: format to enforce, the format is defined by the file extension by default
+          empty: data set without rows with the output columns and dtypes,
+                 it's saved if there are no chunks, hence the output has the csv header, or the schema
+
+       Returns:
+          number of saved rows
+    """
+    rows = 0
+    data_format = get_data_format(path, data_format)
+    try:
+        if data_format == "csv":
+            with _open_gzip(path) as f:
+                header = True
+                for df in chunks:
+                    df.to_csv(f, header=header, index=False)
+                    header = False
+                    rows += len(df)
+                if header and empty is not None:
+                    empty.to_csv(f, index=False)
+            return rows
+
+        writer = None
+        try:
+            for df in chunks:
+                table = _from_pandas(df)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema) if data_format == "parquet" \
+                        else ipc.new_file(path, table.schema)
+                _write_table(writer, table)
+                rows += len(df)
+            if writer is None and empty is not None:
+                table = _from_pandas(empty)
+                writer = pq.ParquetWriter(path, table.schema) if data_format == "parquet" \
+                    else ipc.new_file(path, table.schema)
+                _write_table(writer, table)
+        finally:
+            if writer is not None:
+                writer.close()
     except IOError as ex:
         raise ex
+    return rows
 
 
 def load_data_pkl(path: str) -> Tuple[pd.DataFrame, str]:
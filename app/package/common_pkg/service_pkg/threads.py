@@ -0,0 +1,117 @@
+# Dmitry Kisler © 2019
+# www.dkisler.com
+
+import os
+import math
+from typing import Tuple
+
+
+# env variable to override the number of threads available to the service
+ENV_THREADS = "CPU_THREADS"
+
+# env variables read by the BLAS, OpenMP and joblib pools
+ENV_POOLS = ["OMP_NUM_THREADS",
+             "OPENBLAS_NUM_THREADS",
+             "MKL_NUM_THREADS",
+             "BLIS_NUM_THREADS",
+             "VECLIB_MAXIMUM_THREADS",
+             "NUMEXPR_NUM_THREADS",
+             "LOKY_MAX_CPU_COUNT"]
+
+# cgroup v2 and v1 CPU quota files
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+def _read(path: str) -> str:
+    """Function to read the first line of the file
+
+       Args:
+          path: path to the file
+
+       Returns:
+          stripped line, or None if the file cannot be read
+    """
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except (IOError, OSError):
+        return None
+
+
+def get_cgroup_quota() -> float:
+    """Function to read the container CPU quota from cgroup v2, or v1
+
+       Returns:
+          number of CPUs the container is allowed to use, None if no quota is set
+    """
+    cpu_max = _read(CGROUP_V2_CPU_MAX)
+    if cpu_max is not None:
+        quota, _, period = cpu_max.partition(" ")
+    else:
+        quota, period = _read(CGROUP_V1_QUOTA), _read(CGROUP_V1_PERIOD)
+    try:
+        quota, period = int(quota), int(period)
+    except (TypeError, ValueError):
+        return None
+    if quota <= 0 or period <= 0:
+        return None
+    return quota / period
+
+
+def get_threads() -> Tuple[int, str]:
+    """Function to define the number of threads available to the service
+
+       The env variable CPU_THREADS has priority over the cgroup CPU quota,
+       the number of CPUs the process is bound to is used otherwise.
+
+       Returns:
+          tuple with the number of threads and its source: env, cgroup, or cpu
+
+       Raises:
+          ValueError, CPU_THREADS is not a positive integer
+    """
+    threads = os.getenv(ENV_THREADS)
+    if threads:
+        if not threads.isdigit() or int(threads) < 1:
+            raise ValueError(f"{ENV_THREADS} must be a positive integer, got '{threads}'")
+        return int(threads), "env"
+
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    quota = get_cgroup_quota()
+    if quota is not None and math.ceil(quota) < cpus:
+        return max(int(math.ceil(quota)), 1), "cgroup"
+    return cpus, "cpu"
+
+
+def set_threads(threads: int = None) -> dict:
+    """Function to limit the BLAS, OpenMP and joblib thread pools
+
+       The env variables are inherited by the child processes, e.g. joblib workers,
+       the pools of the already loaded libraries are limited with threadpoolctl if it's installed.
+
+       Args:
+          threads: number of threads, defined by get_threads by default
+
+       Returns:
+          dict with the effective threading configuration
+    """
+    source = "arg"
+    if threads is None:
+        threads, source = get_threads()
+
+    for i in ENV_POOLS:
+        os.environ[i] = str(threads)
+
+    pools = "env"
+    try:
+        from threadpoolctl import threadpool_limits, threadpool_info
+        threadpool_limits(limits=threads)
+        pools = ",".join(sorted({i["internal_api"] for i in threadpool_info()})) or "env"
+    except ImportError:
+        pass
+
+    return {"threads": threads,
+            "source": source,
+            "pools": pools}
@@ -0,0 +1,80 @@
+# Dmitry Kisler © 2019
+# www.dkisler.com
+
+import os
+import importlib.util
+from types import ModuleType
+import pytest
+import pandas as pd
+import numpy as np
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+
+PACKAGE = "service_pkg"
+MODULE = "file_io"
+
+DEVICES = ["Computer", "Smartphone", "Tablet"]
+
+OUTPUT = pd.DataFrame({"entity_id": np.array([4, 5, 6], dtype=np.int64),
+                       "device": pd.Categorical.from_codes([0, 1, 2], categories=DEVICES),
+                       "cr": np.array([.1, .2, .3], dtype=np.float32)})
+
+
+def load_module(module_name: str) -> ModuleType:
+    """Function to load the module.
+
+       Args:
+          module_name: module name
+
+       Returns:
+          module object
+    """
+    file_path = os.path.join(os.path.dirname(
+        DIR), f"{PACKAGE}/{module_name}.py")
+    spec = importlib.util.spec_from_file_location(module_name, file_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+module = load_module(MODULE)
+
+
+@pytest.mark.parametrize("data_format", ["parquet", "feather"])
+def test_save_data_empty_dtypes(tmp_path, data_format):
+    path = str(tmp_path / f"output.{data_format}")
+    path_empty = str(tmp_path / f"empty.{data_format}")
+    module.save_data(OUTPUT, path)
+    module.save_data(OUTPUT.iloc[:0], path_empty)
+
+    df, err = module.load_data(path)
+    df_empty, err_empty = module.load_data(path_empty)
+    assert err is None and err_empty is None
+    assert len(df_empty) == 0
+    assert df_empty.dtypes.equals(df.dtypes), \
+        "Output without rows has different dtypes"
+
+
+@pytest.mark.parametrize("data_format", ["parquet", "feather"])
+def test_save_data_chunks_empty_dtypes(tmp_path, data_format):
+    path = str(tmp_path / f"output.{data_format}")
+    path_empty = str(tmp_path / f"empty.{data_format}")
+    rows = module.save_data_chunks((OUTPUT.iloc[i:i + 2] for i in range(0, len(OUTPUT), 2)), path)
+    rows_empty = module.save_data_chunks(iter([]), path_empty, empty=OUTPUT.iloc[:0])
+    assert rows == len(OUTPUT) and rows_empty == 0
+
+    df, _ = module.load_data(path)
+    df_empty, _ = module.load_data(path_empty)
+    assert len(df_empty) == 0
+    assert df_empty.dtypes.equals(df.dtypes), \
+        "Output without rows has different dtypes"
+    for chunk in module.load_data_chunks(path_empty, 2)[0]:
+        assert chunk.dtypes.equals(df.dtypes)
+
+
+def test_save_data_empty_feather_dictionary(tmp_path):
+    path = str(tmp_path / "empty.feather")
+    module.save_data(OUTPUT.iloc[:0], path)
+    assert list(pd.read_feather(path)["device"].cat.categories) == DEVICES, \
+        "Feather output without rows lost the device categories"
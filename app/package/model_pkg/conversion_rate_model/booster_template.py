@@ -0,0 +1,527 @@
+# Dmitry Kisler © 2019
+# www.dkisler.com
+
+import os
+import time
+from typing import Tuple, NamedTuple, List
+import pandas as pd
+import numpy as np
+from sklearn import metrics
+from sklearn.model_selection import KFold
+from sklearn.base import clone
+import xgboost
+import importlib.util
+import warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+# import model abstract class
+module_name = "model_template"
+file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         f"{module_name}.py")
+spec = importlib.util.spec_from_file_location(module_name, file_path)
+model_template = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(model_template)
+
+
+ESTIMATOR = "XGBRegressor"
+# model artifact file with the booster
+BOOSTER_FILE = "booster.ubj"
+# number of trees to add to the previous model by the warm start
+WARM_START_TREES = 20
+# max number of trees of the warm started model
+MAX_TREES = 400
+
+
+def quantize(X: pd.DataFrame,
+             y: pd.Series = None,
+             ref: xgboost.DMatrix = None,
+             max_bin: int = None,
+             weight: np.ndarray = None) -> xgboost.DMatrix:
+    """Function to build the histogram-quantized matrix for the hist tree method
+
+       xgboost.QuantileDMatrix (xgboost>=1.7) stores the quantized features only,
+       the quantiles are sketched once and taken from the reference matrix if provided.
+       xgboost.DMatrix is used with the older xgboost, its quantized index is built
+       on the first training and cached by the matrix.
+
+       Args:
+            X: pd.DataFrame with features values
+            y: target column values
+            ref: matrix to take the features quantiles from
+            max_bin: max number of bins per feature, the xgboost default is used if None
+            weight: rows weights
+
+       Returns:
+            matrix object
+    """
+    if not hasattr(xgboost, "QuantileDMatrix"):
+        return xgboost.DMatrix(X, y, weight=weight)
+    if max_bin is None:
+        return xgboost.QuantileDMatrix(X, y, weight=weight, ref=ref)
+    return xgboost.QuantileDMatrix(X, y, weight=weight, ref=ref, max_bin=max_bin)
+
+
+def quantize_folds(X: pd.DataFrame,
+                   y: pd.Series,
+                   n_splits: int,
+                   max_bin: int = None,
+                   X_search: pd.DataFrame = None,
+                   y_search: pd.Series = None,
+                   eval_set: List[Tuple[pd.DataFrame, pd.Series]] = None) -> Tuple[xgboost.DMatrix, list]:
+    """Function to build the quantized matrices of the search folds
+
+       The quantiles are sketched once on the full data set and reused by the folds.
+
+       Args:
+            X: pd.DataFrame with features values
+            y: target column values
+            n_splits: number of cross-validation folds
+            max_bin: max number of bins per feature, the xgboost default is used if None
+            X_search: features values to split into the folds, X by default
+            y_search: target column values to split into the folds, y by default
+            eval_set: list of the validation features and target values
+
+       Returns:
+            tuple with the quantized matrix of the full data set to refit the best candidate on
+            and the list of the folds quantized train matrix, test features, test target, and validation matrices
+    """
+    if X_search is None:
+        X_search, y_search = X, y
+    dtrain = quantize(X, y, max_bin=max_bin)
+    folds = []
+    for train, test in KFold(n_splits=n_splits).split(X_search):
+        dtrain_fold = quantize(X_search.iloc[train], y_search.iloc[train], ref=dtrain, max_bin=max_bin)
+        evals = [quantize(X_eval, y_eval, ref=dtrain_fold, max_bin=max_bin)
+                 for X_eval, y_eval in eval_set or []]
+        folds.append((dtrain_fold,
+                      X_search.iloc[test].to_numpy(dtype=np.float32),
+                      y_search.iloc[test].to_numpy(),
+                      evals))
+    return dtrain, folds
+
+
+def train_booster(estimator: xgboost.XGBRegressor,
+                  dtrain: xgboost.DMatrix,
+                  evals: list = None,
+                  xgb_model: xgboost.Booster = None) -> xgboost.Booster:
+    """Function to train the booster with the estimator hyperparameters on the quantized matrix
+
+       Args:
+            estimator: estimator with hyperparameters
+            dtrain: quantized train matrix
+            evals: list of the validation matrices to stop training early
+                with the estimator early_stopping_rounds
+            xgb_model: booster to continue boosting from
+
+       Returns:
+            trained booster
+    """
+    params = estimator.get_params()
+    return xgboost.train({**estimator.get_xgb_params(), "tree_method": "hist"},
+                         dtrain,
+                         num_boost_round=100 if params["n_estimators"] is None else params["n_estimators"],
+                         evals=[(i, f"validation_{k}") for k, i in enumerate(evals or [])],
+                         early_stopping_rounds=params.get("early_stopping_rounds") if evals else None,
+                         verbose_eval=False,
+                         xgb_model=xgb_model)
+
+
+def evaluate_quantized(estimator: xgboost.XGBRegressor,
+                       folds: list,
+                       candidates: List[dict]) -> dict:
+    """Function to evaluate the search candidates by cross-validation on the quantized folds
+
+       Args:
+            estimator: base estimator
+            folds: list of the folds quantized train matrix, test features, test target, and validation matrices
+            candidates: list of the candidates hyperparameters
+
+       Returns:
+            dict with the search results in the cv_results_ format
+    """
+    cv_results = {"params": candidates,
+                  "mean_fit_time": [],
+                  "mean_score_time": [],
+                  **{f"split{k}_test_score": [] for k in range(len(folds))}}
+    for params in candidates:
+        candidate = clone(estimator).set_params(**params)
+        fit_time, score_time = [], []
+        for k, (dtrain, X_test, y_test, evals) in enumerate(folds):
+            t0 = time.time()
+            booster = train_booster(candidate, dtrain, evals)
+            t1 = time.time()
+            # the trees after the best iteration are ignored if the training stopped early
+            best_iteration = getattr(booster, "best_iteration", None)
+            iteration_range = (0, 0) if best_iteration is None else (0, best_iteration + 1)
+            y_pred = booster.inplace_predict(X_test, iteration_range=iteration_range)
+            cv_results[f"split{k}_test_score"].append(-metrics.mean_squared_error(y_test, y_pred))
+            fit_time.append(t1 - t0)
+            score_time.append(time.time() - t1)
+        cv_results["mean_fit_time"].append(np.mean(fit_time))
+        cv_results["mean_score_time"].append(np.mean(score_time))
+    cv_results["mean_test_score"] = np.mean([cv_results[f"split{k}_test_score"] for k in range(len(folds))],
+                                            axis=0)
+    return cv_results
+
+
+class Model(model_template.Model):
+    """XGBoost model definition class, the model versions define the hyperparameters and the search"""
+
+    def __init__(self,
+                 model=None,
+                 nthread=None,
+                 n_jobs=None,
+                 quantized=False,
+                 dedup=False):
+        self.model = model
+        # fit the unique features rows weighted by the number of identical rows
+        self.dedup = dedup
+        # train on the histogram-quantized matrix built once for the search folds and the refit
+        self.quantized = quantized
+        # number of threads to train and predict with, the xgboost default is used if None
+        self.nthread = nthread
+        # number of parallel jobs of the grid search, all CPUs are used if None
+        self.n_jobs = n_jobs
+        # boosting rounds of the latest training, or warm start
+        self.train_report = None
+        # booster extracted from the fitted model for the inplace prediction path
+        self.booster = None
+        self.features = None
+        # prediction lookup table over the distinct features vectors, see tabulate
+        self.table = None
+
+    def _compile(self):
+        """Function to extract the fitted model booster for the inplace prediction path"""
+        self.booster = self.model.get_booster()
+        if self.nthread is not None:
+            self.booster.set_param({"nthread": self.nthread})
+        self.features = self.booster.feature_names
+
+    def set_threads(self,
+                    nthread: int = None,
+                    n_jobs: int = None):
+        """Function to set the estimator threading
+
+           Args:
+                nthread: number of threads to train and predict with, the xgboost default is used if None
+                n_jobs: number of parallel jobs of the grid search
+        """
+        super().set_threads(nthread, n_jobs)
+        if self.model is not None:
+            self.model.set_params(n_jobs=nthread)
+            if self.booster is not None:
+                self._compile()
+
+    def train(self,
+              X: pd.DataFrame,
+              y: pd.Series,
+              eval_set: Tuple[pd.DataFrame, pd.Series] = None,
+              early_stopping_rounds: int = None,
+              sample_weight: np.ndarray = None) -> NamedTuple('model_eval',
+                                                              mse=float):
+        """Train method
+
+           The training stops once the validation mse doesn't improve for early_stopping_rounds rounds
+           if both are provided, the trees after the best iteration are dropped. The validation set
+           is to be held out of the train data, not the data set to evaluate the model on.
+           The trained and kept boosting rounds are assigned to the Model.train_report attr.
+           The identical features rows are collapsed into the unique weighted rows before fit
+           if the model is defined with dedup=True.
+
+           Args:
+                X: pd.DataFrame with features values
+                y: target column values
+                eval_set: validation features and target values
+                early_stopping_rounds: number of rounds without the validation score improvement
+                    to stop the training, early stopping is disabled by default
+                sample_weight: rows weights, e.g. clicks
+
+           Returns:
+                namedtuple with metrics values:
+                    "mse": float
+        """
+        if self.model is None:
+            self._model_definition()
+
+        X_fit, y_fit, weight, inverse = X, y, sample_weight, None
+        if self.dedup:
+            X_fit, y_fit, weight, inverse = model_template.deduplicate(X, y, sample_weight)
+        self._boost(X_fit, y_fit, eval_set, early_stopping_rounds, sample_weight=weight)
+        self.train_report.update({"rows": len(X),
+                                  "unique_rows": len(X_fit)})
+        # evalute on train set
+        y_pred = self.predict(X_fit)
+        if inverse is not None:
+            y_pred = y_pred[inverse]
+        model_eval = self.score(y_true=y, y_pred=y_pred)
+        return model_eval
+
+    def warm_start(self,
+                   X: pd.DataFrame,
+                   y: pd.Series,
+                   path: str,
+                   eval_set: Tuple[pd.DataFrame, pd.Series] = None,
+                   n_estimators: int = WARM_START_TREES,
+                   max_trees: int = MAX_TREES,
+                   prune: bool = False,
+                   early_stopping_rounds: int = None,
+                   sample_weight: np.ndarray = None) -> NamedTuple('model_eval',
+                                                                   mse=float):
+        """Function to continue boosting the previous model on the new data
+
+           The new trees are fitted with the model hyperparameters to the residuals of the previous model.
+           The total number of trees is capped by max_trees: the number of new trees is reduced,
+           or the oldest trees are dropped if prune is set. The training stops early as in the train method.
+
+           Args:
+                X: pd.DataFrame with features values
+                y: target column values
+                path: path to the previous model, see the load method
+                eval_set: validation features and target values
+                n_estimators: number of trees to add to the previous model
+                max_trees: max number of trees of the model
+                prune: flag to drop the oldest trees of the previous model to add n_estimators trees
+                early_stopping_rounds: number of rounds without the validation score improvement
+                    to stop the training, early stopping is disabled by default
+                sample_weight: rows weights, e.g. clicks
+
+           Returns:
+                namedtuple with metrics values:
+                    "mse": float
+
+           Raises:
+                ValueError, the previous model features don't match the data set
+        """
+        previous = self.__class__()
+        previous.load(path)
+        if previous.features is not None and previous.features != list(X.columns):
+            raise ValueError(f"The previous model {path} features don't match the data set")
+        if self.model is None:
+            self._model_definition()
+
+        booster = previous.booster
+        trees = booster.num_boosted_rounds()
+        pruned = 0
+        if prune:
+            pruned = min(max(trees + n_estimators - max_trees, 0), trees)
+            booster = booster[pruned:] if pruned < trees else None
+        else:
+            n_estimators = min(n_estimators, max(max_trees - trees, 0))
+
+        X_fit, y_fit, weight, inverse = X, y, sample_weight, None
+        if self.dedup:
+            X_fit, y_fit, weight, inverse = model_template.deduplicate(X, y, sample_weight)
+        params = self.model.get_params()
+        self.model.set_params(n_estimators=n_estimators)
+        try:
+            self._boost(X_fit, y_fit, eval_set, early_stopping_rounds, xgb_model=booster, sample_weight=weight)
+        finally:
+            self.model.set_params(n_estimators=params["n_estimators"])
+        self.train_report.update({"warm_start": path,
+                                  "pruned": pruned,
+                                  "rows": len(X),
+                                  "unique_rows": len(X_fit)})
+        # evalute on train set
+        y_pred = self.predict(X_fit)
+        if inverse is not None:
+            y_pred = y_pred[inverse]
+        model_eval = self.score(y_true=y, y_pred=y_pred)
+        return model_eval
+
+    def _boost(self,
+               X: pd.DataFrame,
+               y: pd.Series,
+               eval_set: Tuple[pd.DataFrame, pd.Series] = None,
+               early_stopping_rounds: int = None,
+               xgb_model: xgboost.Booster = None,
+               sample_weight: np.ndarray = None):
+        """Function to fit the estimator, the trees after the best iteration are dropped
+
+           Args:
+                X: pd.DataFrame with features values
+                y: target column values
+                eval_set: validation features and target values
+                early_stopping_rounds: number of rounds without the validation score improvement
+                    to stop the training
+                xgb_model: booster to continue boosting from
+                sample_weight: rows weights
+        """
+        init_trees = 0 if xgb_model is None else xgb_model.num_boosted_rounds()
+        early_stopping = eval_set is not None and bool(early_stopping_rounds)
+        self.model.set_params(early_stopping_rounds=early_stopping_rounds if early_stopping else None)
+        if self.quantized:
+            max_bin = self.model.get_params().get("max_bin")
+            dtrain = quantize(X, y, max_bin=max_bin, weight=sample_weight)
+            evals = [quantize(*eval_set, ref=dtrain, max_bin=max_bin)] if early_stopping else None
+            booster = self._fit_quantized(dtrain, evals, xgb_model=xgb_model)
+        else:
+            fit_params = {"eval_set": [eval_set], "verbose": False} if early_stopping else {}
+            self.model.fit(X, y, sample_weight=sample_weight, xgb_model=xgb_model, **fit_params)
+            booster = self.model.get_booster()
+        self.model.set_params(early_stopping_rounds=None)
+
+        rounds = booster.num_boosted_rounds()
+        best_iteration = getattr(booster, "best_iteration", None) if early_stopping else None
+        # the trees after the best iteration are dropped to predict with the best iteration trees only
+        if best_iteration is not None and best_iteration + 1 < rounds:
+            booster = booster[:best_iteration + 1]
+        if booster.num_boosted_rounds() < rounds:
+            self.model.load_model(bytearray(booster.save_raw()))
+        self.table = None
+        self._compile()
+        n_estimators = self.model.get_params()["n_estimators"]
+        self.train_report = {"n_estimators": 100 if n_estimators is None else n_estimators,
+                             "init_trees": init_trees,
+                             "rounds": rounds - init_trees,
+                             "best_iteration": best_iteration,
+                             "trees": self.booster.num_boosted_rounds()}
+
+    def _fit_quantized(self,
+                       dtrain: xgboost.DMatrix,
+                       evals: list = None,
+                       xgb_model: xgboost.Booster = None) -> xgboost.Booster:
+        """Function to fit the estimator on the quantized matrix
+
+           Args:
+                dtrain: quantized train matrix
+                evals: list of the validation matrices to stop training early
+                    with the estimator early_stopping_rounds
+                xgb_model: booster to continue boosting from
+
+           Returns:
+                trained booster
+        """
+        booster = train_booster(self.model, dtrain, evals, xgb_model=xgb_model)
+        self.model.load_model(bytearray(booster.save_raw()))
+        return booster
+
+    def save(self, path: str):
+        """Model saver method
+
+           The booster is stored in the native xgboost UBJSON format
+           with the manifest listing the features order and hyperparameters.
+
+           Args:
+                path: path to save model into
+        """
+        try:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self.model.save_model(os.path.join(path, BOOSTER_FILE))
+            files = {"booster": BOOSTER_FILE}
+            if self.table is not None:
+                self.table.save(os.path.join(path, model_template.TABLE_FILE))
+                files["table"] = model_template.TABLE_FILE
+            model_template.save_manifest(path,
+                                         estimator=ESTIMATOR,
+                                         files=files,
+                                         features=getattr(self.model, "feature_names_in_", None),
+                                         params=self.model.get_xgb_params(),
+                                         training=self.train_report)
+        except Exception as ex:
+            raise ex
+
+    def load(self, path: str):
+        """Model loader method
+
+           Args:
+                path: path to the model manifest, or the model dir,
+                      or to the pickled model (legacy format, *.pkl)
+        """
+        try:
+            self.table = None
+            if path.endswith('.pkl'):
+                self.model = model_template.load_pickle(path)
+                self._compile()
+                return
+
+            manifest, path_dir = model_template.load_manifest(path, estimator=ESTIMATOR)
+            model = xgboost.XGBRegressor()
+            model.load_model(os.path.join(path_dir, manifest["files"]["booster"]))
+            self.model = model
+            self.train_report = manifest.get("training")
+            self._compile()
+            if "table" in manifest["files"]:
+                self.table = model_template.LookupTable.load(os.path.join(path_dir, manifest["files"]["table"]))
+        except Exception as ex:
+            raise ex
+
+    def predict(self,
+                X: pd.DataFrame,
+                iteration_range: Tuple[int, int] = None) -> np.ndarray:
+        """Predict method
+
+           The features are scored by the booster in place,
+           without the DMatrix construction and the sklearn wrapper overhead.
+
+           Args:
+                X: pd.DataFrame with features values
+                iteration_range: trees range [begin, end) to predict with, all trees are used by default
+
+           Raises:
+                Prediction error
+        """
+        if self.model is None:
+            return None
+        try:
+            return self.predict_array(self._to_array(X),
+                                      iteration_range=iteration_range)
+        except Exception as ex:
+            raise ex
+            return None
+
+    def _to_array(self, X: pd.DataFrame) -> np.ndarray:
+        """Function to convert the features to the array in the model features order
+
+           Args:
+                X: pd.DataFrame with features values
+
+           Returns:
+                float32 2d array
+        """
+        if self.booster is not self.model.get_booster():
+            self._compile()
+        if self.features is not None and list(X.columns) != self.features:
+            X = X[self.features]
+        return X.to_numpy(dtype=np.float32)
+
+    def predict_array(self,
+                      X: np.ndarray,
+                      iteration_range: Tuple[int, int] = None) -> np.ndarray:
+        """Predict method for the features array
+
+           The features vectors found in the lookup table are not scored
+           unless the trees range is set, see tabulate.
+
+           Args:
+                X: float32 contiguous 2d array with features values in the model features order,
+                   other arrays are converted by xgboost
+                iteration_range: trees range [begin, end) to predict with, all trees are used by default
+
+           Returns:
+                float32 array with predictions
+
+           Raises:
+                Prediction error
+        """
+        if self.booster is not self.model.get_booster():
+            self._compile()
+        if self.table is not None and iteration_range is None:
+            return self.table.predict(X, self._predict_array)
+        return self._predict_array(X, iteration_range)
+
+    def _predict_array(self,
+                       X: np.ndarray,
+                       iteration_range: Tuple[int, int] = None) -> np.ndarray:
+        """Function to score the features array by the booster in place
+
+           Args:
+                X: float32 contiguous 2d array with features values in the model features order
+                iteration_range: trees range [begin, end) to predict with, all trees are used by default
+
+           Returns:
+                float32 array with predictions
+        """
+        return self.booster.inplace_predict(X,
+                                            iteration_range=iteration_range or (0, 0),
+                                            validate_features=False)
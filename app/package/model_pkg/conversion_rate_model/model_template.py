@@ -1,8 +1,11 @@
 # Dmitry Kisler © 2019
 # www.dkisler.com
 
+import os
+import json
+import pickle
 from collections import namedtuple
-from typing import Tuple, NamedTuple, Any
+from typing import Tuple, NamedTuple, Any, List, Callable
 import numpy as np
 import pandas as pd
 from abc import ABC, abstractmethod
@@ -33,8 +36,344 @@ def data_preparation(df: pd.DataFrame,
 
     except Exception as ex:
         return None, None, ex
+
+
+def deduplicate(X: pd.DataFrame,
+                y: pd.Series,
+                sample_weight: np.ndarray = None) -> Tuple[pd.DataFrame,
+                                                           pd.Series,
+                                                           np.ndarray,
+                                                           np.ndarray]:
+    """Function to collapse the identical features rows into unique rows
+
+    The target of the unique row is the weighted mean target of its identical rows,
+    the weight is the number of identical rows, or the sum of their weights, e.g. clicks.
+    The squared error loss of the model fitted on the unique rows with the weights
+    is equal to the loss on all rows up to a constant, hence the fitted model is equivalent.
+
+    Args:
+        X: pd.DataFrame with features values
+        y: target column values
+        sample_weight: rows weights, the rows are equally weighted by default
+
+    Returns:
+        tuple of the unique rows features DataFrame,
+                  target column,
+                  weights
+                  and the index of the unique row of every input row
+    """
+    # the rows are sorted by all columns and the identical rows are found as the equal neighbours
+    values = X.to_numpy()
+    order = np.lexsort(values.T[::-1])
+    values = values[order]
+    first = np.empty(len(values), dtype=bool)
+    first[:1] = True
+    np.any(values[1:] != values[:-1], axis=1, out=first[1:])
+    index = order[first]
+    inverse = np.empty(len(values), dtype=np.intp)
+    inverse[order] = np.cumsum(first) - 1
+    weight = np.ones(len(X)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+    weight_sum = np.bincount(inverse, weights=weight)
+    target = np.divide(np.bincount(inverse, weights=weight * np.asarray(y, dtype=np.float64)), weight_sum,
+                       out=np.zeros(len(index)),
+                       where=weight_sum > 0)
+    return X.iloc[index].reset_index(drop=True), pd.Series(target, name=y.name), weight_sum, inverse
+
+
+# model artifact manifest file name and format version
+MANIFEST = "model.json"
+ARTIFACT_VERSION = 1
+# model artifact file with the prediction lookup table
+TABLE_FILE = "table.npz"
+
+
+def save_manifest(path: str,
+                  estimator: str,
+                  files: dict,
+                  features: List[str] = None,
+                  params: dict = None,
+                  training: dict = None):
+    """Function to save the model artifact manifest
+
+    Args:
+        path: model artifact dir
+        estimator: estimator class name
+        files: dict with the artifact data files names
+        features: list of features in the order the model was trained with
+        params: dict with model hyperparameters
+        training: dict with the training report, e.g. the early stopping best iteration
+
+    Raises:
+        IOError, save error
+    """
+    manifest = {
+        "artifact_version": ARTIFACT_VERSION,
+        "estimator": estimator,
+        "files": files,
+        "features": None if features is None else [str(i) for i in features],
+        "params": params,
+        "training": training
+    }
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+
+def load_manifest(path: str,
+                  estimator: str) -> Tuple[dict, str]:
+    """Function to load the model artifact manifest
+
+    Args:
+        path: path to the manifest file, or to the model artifact dir
+        estimator: expected estimator class name
+
+    Returns:
+        tuple with the manifest dict and the model artifact dir
+
+    Raises:
+        IOError, load error
+        ValueError, the artifact is not compatible with the model
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST)
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get("artifact_version") != ARTIFACT_VERSION:
+        raise ValueError(f"Model artifact version {manifest.get('artifact_version')} is not supported")
+    if manifest.get("estimator") != estimator:
+        raise ValueError(f"Model artifact estimator {manifest.get('estimator')} doesn't match {estimator}")
+    return manifest, os.path.dirname(path)
+
+
+# modules of the legacy pickled models moved in the installed dependencies
+LEGACY_MODULES = {
+    "sklearn.linear_model.base": "sklearn.linear_model._base",
+}
+
+
+class _PickledBooster:
+    """Placeholder of the pickled xgboost booster state"""
+
+    def __setstate__(self, state: dict):
+        self.state = state
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """Unpickler of the legacy models with the moved modules aliased"""
+
+    def find_class(self, module: str, name: str):
+        if (module, name) == ("xgboost.core", "Booster"):
+            return _PickledBooster
+        return super().find_class(LEGACY_MODULES.get(module, module), name)
+
+
+def _restore_booster(state: dict):
+    """Function to restore the pickled xgboost booster
+
+    Args:
+        state: pickled booster state
+
+    Returns:
+        xgboost.Booster
+
+    Raises:
+        ValueError, the installed xgboost cannot read the booster binary
+    """
+    import xgboost
+    booster = xgboost.Booster.__new__(xgboost.Booster)
+    try:
+        booster.__setstate__(dict(state))
+        return booster
+    except xgboost.core.XGBoostError:
+        pass
+    # xgboost<1.0 pickles the booster binary model instead of its serialized state
+    booster = xgboost.Booster()
+    try:
+        booster.load_model(bytearray(state["handle"]))
+    except xgboost.core.XGBoostError as ex:
+        raise ValueError(f"Legacy xgboost binary model cannot be read by xgboost {xgboost.__version__}, "
+                         "load it with xgboost<3 and save it as the model artifact") from ex
+    if state.get("feature_names") is not None:
+        booster.feature_names = state["feature_names"]
+        booster.feature_types = state.get("feature_types")
+    return booster
+
+
+def load_pickle(path: str) -> Any:
+    """Function to load the pickled model (legacy format, *.pkl)
+
+    The modules moved since the model was pickled are aliased,
+    the hyperparameters added since are set to the defaults,
+    the xgboost<1.0 booster is restored from its binary model.
+
+    Args:
+        path: path to the pickled model
+
+    Returns:
+        fitted estimator
+
+    Raises:
+        IOError, load error
+        ValueError, the installed dependencies cannot restore the model
+    """
+    with open(path, 'rb') as f:
+        model = _LegacyUnpickler(f).load()
+    if isinstance(model.__dict__.get("_Booster"), _PickledBooster):
+        model._Booster = _restore_booster(model._Booster.state)
+    if hasattr(model, "get_params"):
+        for k, v in type(model)().get_params(deep=False).items():
+            model.__dict__.setdefault(k, v)
+    return model
     
 
+
+class LookupTable:
+    """Prediction lookup table over the observed distinct features vectors
+
+    Every feature value is encoded by its index in the vocabulary of the feature values
+    the table is built on, the codes are bit-packed into the uint64 key of the features vector.
+    The keys are looked up in the hash index of the table keys, the vectors with the values
+    missing in the vocabularies, or the keys missing in the table are predicted by the model.
+    """
+
+    def __init__(self,
+                 vocabs: List[np.ndarray],
+                 keys: np.ndarray,
+                 values: np.ndarray):
+        """Instantiate the table
+
+            Args:
+                vocabs: list of the sorted unique values of every feature
+                keys: unique packed keys of the features vectors
+                values: predictions of the features vectors
+
+            Raises:
+                ValueError, the packed key doesn't fit 64 bits
+        """
+        self.vocabs = vocabs
+        self.keys = keys
+        self.values = values
+        bits = [(len(i) - 1).bit_length() for i in vocabs]
+        if sum(bits) > 64:
+            raise ValueError(f"The features vector key of {sum(bits)} bits doesn't fit 64 bits")
+        self.shifts = np.cumsum([0, *bits[:-1]]).astype(np.uint64)
+        self.index = pd.Index(keys)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def build(cls,
+              X: np.ndarray,
+              predict: Callable[[np.ndarray], np.ndarray]) -> 'LookupTable':
+        """Function to build the table over the distinct features vectors of the data set
+
+            Args:
+                X: 2d array with features values in the model features order
+                predict: function to predict the features array
+
+            Returns:
+                lookup table object
+        """
+        vocabs = [np.unique(i[~np.isnan(i)]) for i in X.T]
+        table = cls(vocabs,
+                    keys=np.empty(0, dtype=np.uint64),
+                    values=np.empty(0))
+        keys, valid = table.encode(X)
+        keys, index = np.unique(keys[valid], return_index=True)
+        return cls(vocabs,
+                   keys=keys,
+                   values=predict(np.ascontiguousarray(X[valid][index])))
+
+    def encode(self,
+               X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Function to pack the features vectors into the keys
+
+            Args:
+                X: 2d array with features values in the model features order
+
+            Returns:
+                tuple with the keys and the mask of the vectors with all values in the vocabularies
+        """
+        keys = np.zeros(len(X), dtype=np.uint64)
+        valid = np.ones(len(X), dtype=bool)
+        for vocab, shift, column in zip(self.vocabs, self.shifts, X.T):
+            code = np.searchsorted(vocab, column)
+            np.minimum(code, len(vocab) - 1, out=code)
+            valid &= vocab[code] == column
+            keys |= code.astype(np.uint64) << shift
+        return keys, valid
+
+    def predict(self,
+                X: np.ndarray,
+                predict: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """Function to predict the features vectors with the table
+
+            Args:
+                X: 2d array with features values in the model features order
+                predict: function to predict the features vectors missing in the table
+
+            Returns:
+                array with predictions
+        """
+        if not len(self.keys):
+            self.misses += len(X)
+            return predict(X)
+        keys, valid = self.encode(X)
+        position = self.index.get_indexer(keys)
+        found = valid & (position >= 0)
+        y_pred = self.values[position]
+        n_found = int(found.sum())
+        if n_found < len(X):
+            missing = ~found
+            y_pred[missing] = predict(np.ascontiguousarray(X[missing]))
+        self.hits += n_found
+        self.misses += len(X) - n_found
+        return y_pred
+
+    def report(self) -> dict:
+        """Function to report the table size and the lookups hit rate
+
+            Returns:
+                dict with the number of table entries, hits, misses and the hit rate
+        """
+        lookups = self.hits + self.misses
+        return {"entries": len(self.keys),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None}
+
+    def save(self, path: str):
+        """Function to save the table
+
+            Args:
+                path: path to the table file, npz
+
+            Raises:
+                IOError, save error
+        """
+        np.savez(path,
+                 keys=self.keys,
+                 values=self.values,
+                 **{f"vocab_{i}": vocab for i, vocab in enumerate(self.vocabs)})
+
+    @classmethod
+    def load(cls, path: str) -> 'LookupTable':
+        """Function to load the table
+
+            Args:
+                path: path to the table file, npz
+
+            Returns:
+                lookup table object
+
+            Raises:
+                IOError, load error
+        """
+        with np.load(path) as table:
+            return cls([table[f"vocab_{i}"] for i in range(len(table.files) - 2)],
+                       keys=table["keys"],
+                       values=table["values"])
+
+
 class Model(ABC):
     """"Model definition class"""
     model_eval = namedtuple('model_eval', ['mse'])
@@ -42,6 +381,37 @@ class Model(ABC):
     def __init__(self,
                  model=None):
         self.model = model
+
+    def tabulate(self, X: pd.DataFrame) -> dict:
+        """Function to build the prediction lookup table over the distinct features vectors of the data set
+
+           The table is assigned to the Model.table attr and used by predict
+           until the model is trained again.
+
+           Args:
+                X: pd.DataFrame with features values
+
+           Returns:
+                dict with the table report
+
+           Raises:
+                ValueError, the features vector key doesn't fit 64 bits
+        """
+        self.table = None
+        self.table = LookupTable.build(self._to_array(X), self.predict_array)
+        return self.table.report()
+
+    def set_threads(self,
+                    nthread: int = None,
+                    n_jobs: int = None):
+        """Function to set the estimator threading
+
+           Args:
+                nthread: number of threads to train and predict with, the library default is used if None
+                n_jobs: number of parallel jobs of the hyperparameters search
+        """
+        self.nthread = nthread
+        self.n_jobs = n_jobs
     
     @abstractmethod
     def _model_definition(self, 
@@ -59,13 +429,17 @@ class Model(ABC):
     @abstractmethod    
     def train(self,
               X: pd.DataFrame,
-              y: pd.Series) -> NamedTuple('model_eval',
-                                          mse=float):
+              y: pd.Series,
+              eval_set: Tuple[pd.DataFrame, pd.Series] = None,
+              sample_weight: np.ndarray = None) -> NamedTuple('model_eval',
+                                                              mse=float):
         """Train method
 
            Args:
                 X: pd.DataFrame with features values
                 y: target column values
+                eval_set: validation features and target values
+                sample_weight: rows weights, e.g. clicks
 
            Returns: 
                 namedtuple with metrics values: 
@@ -5,7 +5,6 @@ import os
 from typing import Tuple, NamedTuple
 import pandas as pd
 import numpy as np
-import pickle
 from sklearn import metrics
 from sklearn.linear_model import LinearRegression
 import importlib.util
@@ -24,13 +23,106 @@ spec.loader.exec_module(model_template)
 
 data_preparation = model_template.data_preparation
 
+ESTIMATOR = "LinearRegression"
+# model artifact file with the intercept and coefficients
+COEF_FILE = "coef.npy"
+# model artifact file with the least squares sufficient statistics to update the model incrementally
+STATS_FILE = "stats.npz"
+
+
+def sufficient_statistics(X: pd.DataFrame,
+                          y: pd.Series,
+                          sample_weight: np.ndarray = None) -> dict:
+    """Function to calculate the least squares sufficient statistics of the data set
+
+       The cross-products are calculated over the centered data to keep the precision
+       of the statistics accumulated over many data sets.
+
+       Args:
+          X: pd.DataFrame with features values
+          y: target column values
+          sample_weight: rows weights, the rows are equally weighted by default
+
+       Returns:
+          dict with the number of rows "n" (sum of weights), features and target means "x_mean" and "y_mean",
+          centered cross-products "xx" (X^T X), "xy" (X^T y) and "yy" (y^T y)
+    """
+    X = X.to_numpy(dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if sample_weight is None:
+        x_mean, y_mean = X.mean(axis=0), y.mean()
+        X = X - x_mean
+        y = y - y_mean
+        return {"n": len(y),
+                "x_mean": x_mean,
+                "y_mean": y_mean,
+                "xx": X.T @ X,
+                "xy": X.T @ y,
+                "yy": y @ y}
+    w = np.asarray(sample_weight, dtype=np.float64)
+    x_mean, y_mean = np.average(X, axis=0, weights=w), np.average(y, weights=w)
+    X = X - x_mean
+    y = y - y_mean
+    return {"n": w.sum(),
+            "x_mean": x_mean,
+            "y_mean": y_mean,
+            "xx": (X.T * w) @ X,
+            "xy": (X.T * w) @ y,
+            "yy": (y * w) @ y}
+
+
+def merge_statistics(a: dict,
+                     b: dict) -> dict:
+    """Function to merge the least squares sufficient statistics of two data sets
+
+       Args:
+          a: sufficient statistics of the first data set
+          b: sufficient statistics of the second data set
+
+       Returns:
+          dict with the sufficient statistics of the concatenated data sets
+    """
+    if a["n"] == 0 or b["n"] == 0:
+        return a if b["n"] == 0 else b
+    n = a["n"] + b["n"]
+    dx, dy = b["x_mean"] - a["x_mean"], b["y_mean"] - a["y_mean"]
+    w = a["n"] * b["n"] / n
+    return {"n": n,
+            "x_mean": a["x_mean"] + dx * b["n"] / n,
+            "y_mean": a["y_mean"] + dy * b["n"] / n,
+            "xx": a["xx"] + b["xx"] + np.outer(dx, dx) * w,
+            "xy": a["xy"] + b["xy"] + dx * dy * w,
+            "yy": a["yy"] + b["yy"] + dy * dy * w}
+
 
 class Model(model_template.Model):
     """"Model definition class"""
 
     def __init__(self,
-                 model=None):
+                 model=None,
+                 dedup=False):
         self.model = model
+        # fit the unique features rows weighted by the number of identical rows
+        self.dedup = dedup
+        # number of train rows and unique rows of the latest training
+        self.train_report = None
+        # coefficients extracted from the fitted model for the numpy prediction path
+        self.compiled = None
+        self.coef = None
+        self.intercept = None
+        self.features = None
+        # least squares sufficient statistics of all data the model is trained on
+        self.stats = None
+        # prediction lookup table over the distinct features vectors, see tabulate
+        self.table = None
+
+    def _compile(self):
+        """Function to extract the fitted model coefficients for the numpy prediction path"""
+        self.coef = np.ascontiguousarray(self.model.coef_, dtype=np.float64)
+        self.intercept = float(self.model.intercept_)
+        features = getattr(self.model, "feature_names_in_", None)
+        self.features = None if features is None else list(features)
+        self.compiled = self.model
 
     def _model_definition(self,
                           config=None):
@@ -47,13 +139,20 @@ class Model(model_template.Model):
 
     def train(self,
               X: pd.DataFrame,
-              y: pd.Series) -> NamedTuple('model_eval',
-                                          mse=float):
+              y: pd.Series,
+              eval_set: Tuple[pd.DataFrame, pd.Series] = None,
+              sample_weight: np.ndarray = None) -> NamedTuple('model_eval',
+                                                              mse=float):
         """Train method
 
+        The identical features rows are collapsed into the unique weighted rows before fit
+        if the model is defined with dedup=True.
+
         Args:
             X: pd.DataFrame with features values
             y: target column values
+            eval_set: validation features and target values, not used by the linear regression
+            sample_weight: rows weights, e.g. clicks
 
         Returns: 
             namedtuple with metrics values: 
@@ -61,16 +160,114 @@ class Model(model_template.Model):
         """
         if self.model is None:
             self._model_definition()
+        self.table = None
 
-        self.model.fit(X, y)
+        X_fit, y_fit, weight, inverse = X, y, sample_weight, None
+        if self.dedup:
+            X_fit, y_fit, weight, inverse = model_template.deduplicate(X, y, sample_weight)
+        self.model.fit(X_fit, y_fit, sample_weight=weight)
+        self.stats = sufficient_statistics(X_fit, y_fit, weight)
+        if inverse is not None:
+            # the target variance within the identical rows
+            w = 1. if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+            self.stats["yy"] += float(np.sum(w * (np.asarray(y, dtype=np.float64) - y_fit.to_numpy()[inverse]) ** 2))
+        self._compile()
+        self.train_report = {"rows": len(X),
+                             "unique_rows": len(X_fit)}
         # evalute on train set
-        y_pred = self.predict(X)
+        y_pred = self.predict(X_fit)
+        if inverse is not None:
+            y_pred = y_pred[inverse]
         model_eval = self.score(y_true=y, y_pred=y_pred)
         return model_eval
 
+    def partial_fit(self,
+                    X: pd.DataFrame,
+                    y: pd.Series,
+                    sample_weight: np.ndarray = None) -> NamedTuple('model_eval',
+                                                                    mse=float):
+        """Function to update the model with the data set chunk
+
+        The chunk sufficient statistics are merged into the model statistics
+        and the coefficients are solved from the accumulated statistics,
+        hence the model matches the model trained on all chunks at once,
+        and the memory doesn't depend on the number of rows.
+
+        Args:
+            X: pd.DataFrame with features values
+            y: target column values
+            sample_weight: rows weights, e.g. clicks, the mse is weighted then
+
+        Returns:
+            namedtuple with metrics values on all data the model is trained on:
+                "mse": float
+
+        Raises:
+            ValueError, the model has no sufficient statistics, or its features don't match the chunk
+        """
+        if self.model is None:
+            self._model_definition()
+        if self.stats is None and self.coef is not None:
+            raise ValueError("The model has no sufficient statistics to be updated, train the model from scratch")
+        if self.features is not None and list(X.columns) != self.features:
+            raise ValueError("The model features don't match the data set")
+
+        stats = sufficient_statistics(X, y, sample_weight)
+        self.stats = stats if self.stats is None else merge_statistics(self.stats, stats)
+        self._solve(features=list(X.columns))
+        # residual sum of squares of the least squares solution
+        rss = self.stats["yy"] - self.stats["xy"] @ self.model.coef_
+        return self.model_eval(mse=max(float(rss), 0.) / self.stats["n"])
+
+    def warm_start(self,
+                   X: pd.DataFrame,
+                   y: pd.Series,
+                   path: str,
+                   eval_set: Tuple[pd.DataFrame, pd.Series] = None,
+                   sample_weight: np.ndarray = None) -> NamedTuple('model_eval',
+                                                                   mse=float):
+        """Function to update the previous model with the new data
+
+        Args:
+            X: pd.DataFrame with features values
+            y: target column values
+            path: path to the previous model, see the load method
+            eval_set: validation features and target values, not used by the linear regression
+            sample_weight: rows weights, e.g. clicks, the mse is weighted then
+
+        Returns:
+            namedtuple with metrics values on all data the model is trained on:
+                "mse": float
+
+        Raises:
+            ValueError, the previous model has no sufficient statistics, or its features don't match the data set
+        """
+        self.load(path)
+        return self.partial_fit(X, y, sample_weight=sample_weight)
+
+    def _solve(self,
+               features: list = None):
+        """Function to solve the least squares coefficients from the sufficient statistics
+
+        Args:
+            features: list of features in the order of the statistics
+        """
+        coef = np.linalg.lstsq(self.stats["xx"], self.stats["xy"], rcond=None)[0]
+        self.model.coef_ = coef
+        self.model.intercept_ = float(self.stats["y_mean"] - self.stats["x_mean"] @ coef)
+        self.model.n_features_in_ = len(coef)
+        if features is not None:
+            self.model.feature_names_in_ = np.array(features, dtype=object)
+        self.table = None
+        self._compile()
+
     def save(self, path: str):
         """Model saver method
 
+        The intercept and coefficients are stored as the numpy array
+        [intercept, *coef] with the manifest listing the features order,
+        the sufficient statistics are stored to update the model incrementally.
+
         Args:
             path: path to save model into
 
@@ -80,8 +277,20 @@ class Model(model_template.Model):
         try:
             if not os.path.isdir(path):
                 os.makedirs(path)
-            with open(os.path.join(path, 'model.pkl'), 'wb') as f:
-                pickle.dump(self.model, f)
+            np.save(os.path.join(path, COEF_FILE),
+                    np.concatenate([[self.model.intercept_], self.model.coef_]))
+            files = {"coef": COEF_FILE}
+            if self.stats is not None:
+                np.savez(os.path.join(path, STATS_FILE), **self.stats)
+                files["stats"] = STATS_FILE
+            if self.table is not None:
+                self.table.save(os.path.join(path, model_template.TABLE_FILE))
+                files["table"] = model_template.TABLE_FILE
+            model_template.save_manifest(path,
+                                         estimator=ESTIMATOR,
+                                         files=files,
+                                         features=getattr(self.model, "feature_names_in_", None),
+                                         params=self.model.get_params())
         except Exception as ex:
             raise ex
 
@@ -89,20 +298,47 @@ class Model(model_template.Model):
         """Model loader method
 
         Args:
-            path: path to save model into
+            path: path to the model manifest, or the model dir,
+                  or to the pickled model (legacy format, *.pkl)
 
         Raises:
             IOError, load error
         """
         try:
-            with open(path, 'rb') as f:
-                self.model = pickle.load(f)
+            self.stats = None
+            self.table = None
+            if path.endswith('.pkl'):
+                self.model = model_template.load_pickle(path)
+                self._compile()
+                return
+
+            manifest, path_dir = model_template.load_manifest(path, estimator=ESTIMATOR)
+            weights = np.load(os.path.join(path_dir, manifest["files"]["coef"]),
+                              mmap_mode='r')
+            # ignore hyperparameters unknown to the installed sklearn version
+            params = LinearRegression().get_params()
+            model = LinearRegression(**{k: v for k, v in manifest["params"].items() if k in params})
+            model.intercept_ = float(weights[0])
+            model.coef_ = weights[1:]
+            model.n_features_in_ = len(model.coef_)
+            if manifest["features"] is not None:
+                model.feature_names_in_ = np.array(manifest["features"], dtype=object)
+            self.model = model
+            if "stats" in manifest["files"]:
+                with np.load(os.path.join(path_dir, manifest["files"]["stats"])) as stats:
+                    self.stats = {k: stats[k] if stats[k].ndim else stats[k].item() for k in stats.files}
+            self._compile()
+            if "table" in manifest["files"]:
+                self.table = model_template.LookupTable.load(os.path.join(path_dir, manifest["files"]["table"]))
         except Exception as ex:
             raise ex
 
-    def predict(self, X: pd.DataFrame) -> pd.Series:
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
         """Predict method
 
+        The features are scored as X @ coef + intercept
+        with the coefficients extracted from the fitted model.
+
         Args:
             X: pd.DataFrame with features values
 
@@ -112,7 +348,69 @@ class Model(model_template.Model):
         if self.model is None:
             return None
         try:
-            return self.model.predict(X)
+            return self.predict_array(self._to_array(X))
         except Exception as ex:
             raise ex
             return None
+
+    def _to_array(self, X: pd.DataFrame) -> np.ndarray:
+        """Function to convert the features to the array in the model features order
+
+        Args:
+            X: pd.DataFrame with features values
+
+        Returns:
+            float64 2d array
+        """
+        if self.compiled is not self.model:
+            self._compile()
+        if self.features is not None and list(X.columns) != self.features:
+            X = X[self.features]
+        return X.to_numpy(dtype=np.float64)
+
+    def predict_array(self,
+                      X: np.ndarray,
+                      out: np.ndarray = None) -> np.ndarray:
+        """Predict method for the features array
+
+        The features vectors found in the lookup table are not scored, see tabulate.
+
+        Args:
+            X: float32, or float64 contiguous 2d array with features values in the model features order
+            out: optional float64 1d array to write predictions into
+
+        Returns:
+            float64 array with predictions
+
+        Raises:
+            Prediction error
+        """
+        if self.compiled is not self.model:
+            self._compile()
+        if self.table is None:
+            return self._predict_array(X, out)
+        y_pred = self.table.predict(X, self._predict_array)
+        if out is None:
+            return y_pred
+        out[:] = y_pred
+        return out
+
+    def _predict_array(self,
+                       X: np.ndarray,
+                       out: np.ndarray = None) -> np.ndarray:
+        """Function to score the features array as X @ coef + intercept
+
+        Every row is reduced on its own over a C-contiguous array, so a row
+        prediction does not depend on the batch it is scored in: chunked,
+        deduplicated and full file predictions are byte-identical.
+
+        Args:
+            X: float32, or float64 2d array with features values in the model features order
+            out: optional float64 1d array to write predictions into
+
+        Returns:
+            float64 array with predictions
+        """
+        out = np.einsum('ij,j->i', np.ascontiguousarray(X), self.coef, out=out)
+        out += self.intercept
+        return out
@@ -2,31 +2,227 @@
 # www.dkisler.com
 
 import os
-from typing import Tuple, NamedTuple
+import re
+import time
+import json
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import Tuple, NamedTuple, Iterator, Callable, List
+from functools import partial
 import pandas as pd
 import numpy as np
-import pickle
-from sklearn import metrics
-from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV, ParameterGrid, ParameterSampler, \
+    train_test_split
+from sklearn.experimental import enable_halving_search_cv  # noqa
+from sklearn.model_selection import HalvingGridSearchCV, HalvingRandomSearchCV
 import xgboost
+from joblib import effective_n_jobs
 import importlib.util
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
-# import model abstract class
-module_name = "model_template"
+# import xgboost model definition class
+module_name = "booster_template"
 file_path = os.path.join(os.path.dirname(
     os.path.dirname(os.path.abspath(__file__))),
     f"{module_name}.py")
 spec = importlib.util.spec_from_file_location(module_name, file_path)
-model_template = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(model_template)
+booster_template = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(booster_template)
+model_template = booster_template.model_template
 
 
 data_preparation = model_template.data_preparation
 
+# hyperparameters search strategies
+SEARCH_STRATEGIES = ("grid", "random", "halving")
+# budgets of the successive halving search
+SEARCH_RESOURCES = ("n_samples", "n_estimators")
 
-class Model(model_template.Model):
+
+@contextmanager
+def shared_data(X: pd.DataFrame,
+                y: pd.Series,
+                fit_params: dict,
+                share: bool = True) -> Iterator[Tuple[np.ndarray, np.ndarray, dict]]:
+    """Function to place the search data set into the memory-mapped files
+
+       The parallel search workers attach the memory-mapped arrays zero-copy
+       instead of receiving the data set copy for every fit.
+       The features are stored as float32, the dtype the estimator converts them to.
+       The files are created in the shared memory /dev/shm if available and removed on exit.
+
+       Args:
+            X: pd.DataFrame with features values
+            y: target column values
+            fit_params: estimator fit parameters with the optional "eval_set"
+            share: flag to share the data set, the data set is passed through if False
+
+       Returns:
+            iterator with the memory-mapped features, target, and the fit parameters
+    """
+    if not share:
+        yield X, y, fit_params
+        return
+
+    folder = tempfile.mkdtemp(prefix="search_",
+                              dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+    def to_shared(name: str, values: np.ndarray) -> np.ndarray:
+        path = os.path.join(folder, f"{name}.npy")
+        np.save(path, values)
+        return np.load(path, mmap_mode='r')
+
+    try:
+        fit_params = dict(fit_params)
+        if "eval_set" in fit_params:
+            fit_params["eval_set"] = [(to_shared(f"X_eval{i}", np.asarray(X_eval, dtype=np.float32)),
+                                       to_shared(f"y_eval{i}", np.asarray(y_eval, dtype=np.float64)))
+                                      for i, (X_eval, y_eval) in enumerate(fit_params["eval_set"])]
+        yield (to_shared("X", np.asarray(X, dtype=np.float32)),
+               to_shared("y", np.asarray(y, dtype=np.float64)),
+               fit_params)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def search_fingerprint(X: pd.DataFrame,
+                       y: pd.Series,
+                       config: dict,
+                       options: dict) -> str:
+    """Function to fingerprint the search data set, grid and options
+
+       Args:
+            X: pd.DataFrame with features values
+            y: target column values
+            config: dictionary with a grid of hyperparameters
+            options: search options affecting the candidates scores
+
+       Returns:
+            sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([list(X.columns), config, options],
+                             sort_keys=True, default=str).encode())
+    digest.update(pd.util.hash_pandas_object(X, index=False).values.tobytes())
+    digest.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def candidate_id(params: dict) -> str:
+    """Function to define the search candidate id
+
+       Args:
+            params: candidate hyperparameters
+
+       Returns:
+            candidate hyperparameters serialized to json
+    """
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def load_trials(path: str,
+                key: str) -> dict:
+    """Function to read the completed trials of the search from the trials journal
+
+       Args:
+            path: path to the trials journal, json lines file
+            key: search fingerprint
+
+       Returns:
+            dict with the trials by the candidates ids
+    """
+    trials = {}
+    if not os.path.isfile(path):
+        return trials
+    with open(path) as f:
+        for line in f:
+            try:
+                trial = json.loads(line)
+            except ValueError:
+                # the line truncated by the interrupted job
+                continue
+            if trial.get("key") == key:
+                trials[trial["candidate"]] = trial
+    return trials
+
+
+def evaluate_candidates(search_options: dict,
+                        X: np.ndarray,
+                        y: np.ndarray,
+                        fit_params: dict,
+                        candidates: List[dict]) -> dict:
+    """Function to evaluate the search candidates by cross-validation
+
+       Args:
+            search_options: GridSearchCV options
+            X: features values
+            y: target column values
+            fit_params: estimator fit parameters
+            candidates: list of the candidates hyperparameters
+
+       Returns:
+            dict with the search results in the cv_results_ format
+    """
+    grid = GridSearchCV(param_grid=[{k: [v] for k, v in params.items()} for params in candidates],
+                        **search_options)
+    grid.fit(X, y, **fit_params)
+    return grid.cv_results_
+
+
+def search_report(cv_results: dict,
+                  search_time: float) -> dict:
+    """Function to report the best score found against the search time
+
+       Args:
+            cv_results: search results, cv_results_ attribute of the search object
+            search_time: search wall-clock time in sec
+
+       Returns:
+            dict with the search time, the number of fits, and the best mse
+            against the cumulative fit time of the evaluated candidates:
+            the best mse improvements for the grid and random search,
+            the best mse of every iteration for the successive halving,
+            the scores of different iterations are not comparable as they're estimated with different budgets
+    """
+    n_splits = len([i for i in cv_results if re.fullmatch(r"split\d+_test_score", i)])
+    fit_time = np.cumsum((np.asarray(cv_results["mean_fit_time"]) +
+                          np.asarray(cv_results["mean_score_time"])) * n_splits)
+    mse = -np.asarray(cv_results["mean_test_score"], dtype=np.float64)
+
+    progress = []
+    if "iter" in cv_results:
+        iters = np.asarray(cv_results["iter"])
+        for i in np.unique(iters):
+            idx = np.flatnonzero(iters == i)
+            if np.isnan(mse[idx]).all():
+                continue
+            best = idx[np.nanargmin(mse[idx])]
+            progress.append({"iter": int(i),
+                             "n_resources": int(cv_results["n_resources"][best]),
+                             "candidates": len(idx),
+                             "fit_time": round(float(fit_time[idx[-1]]), 2),
+                             "mse": float(mse[best]),
+                             "params": cv_results["params"][best]})
+    else:
+        best = np.inf
+        for i in range(len(mse)):
+            if mse[i] < best:
+                best = mse[i]
+                progress.append({"fit_time": round(float(fit_time[i]), 2),
+                                 "mse": float(best),
+                                 "params": cv_results["params"][i]})
+
+    return {"search_time": round(search_time, 2),
+            "candidates": len(mse),
+            "fits": len(mse) * n_splits,
+            "fit_time": round(float(fit_time[-1]), 2) if len(mse) else 0.,
+            "progress": progress}
+
+
+class Model(booster_template.Model):
     """"Model definition class"""
     CONFIG = {
         "learning_rate": 0.1,
@@ -35,8 +231,14 @@ class Model(model_template.Model):
     }
     
     def __init__(self,
-                 model=None):
-        self.model = model
+                 model=None,
+                 nthread=None,
+                 n_jobs=None,
+                 quantized=False,
+                 dedup=False):
+        super().__init__(model, nthread, n_jobs, quantized, dedup)
+        # best score against the search time of the latest grid search
+        self.search_report = None
 
     def _model_definition(self, 
                           config=CONFIG):
@@ -50,105 +252,236 @@ class Model(model_template.Model):
         """
         if self.model is None:
             if config is None:
-                self.model = xgboost.XGBRegressor(objective='reg:squarederror')
+                self.model = xgboost.XGBRegressor(objective='reg:squarederror',
+                                                  n_jobs=self.nthread)
             else:
                 self.model = xgboost.XGBRegressor(**config, 
-                                                  objective='reg:squarederror')
-
-    def train(self,
-              X: pd.DataFrame,
-              y: pd.Series) -> NamedTuple('model_eval',
-                                          mse=float):
-        """Train method
-
-           Args:
-                X: pd.DataFrame with features values
-                y: target column values
+                                                  objective='reg:squarederror',
+                                                  n_jobs=self.nthread)
 
-           Returns: 
-                namedtuple with metrics values: 
-                    "mse": float
-        """
-        if self.model is None:
-            self._model_definition()
-
-        self.model.fit(X, y)
-        # evalute on train set
-        y_pred = self.predict(X)
-        model_eval = self.score(y_true=y, y_pred=y_pred)
-        return model_eval
-    
     def grid_search(self,
                     X: pd.DataFrame,
                     y: pd.Series,
-                    config: dict) -> NamedTuple('model_eval',
-                                                mse=float):
+                    config: dict,
+                    strategy: str = "grid",
+                    n_candidates: int = None,
+                    resource: str = "n_samples",
+                    early_stopping_rounds: int = None,
+                    journal: str = None) -> NamedTuple('model_eval',
+                                                       mse=float):
         """Function for hyper-parameters tuning to search best configuration of the estimator
            Results in the best tuned estimator object being assigned to the Model.model attr
+           and the search report being assigned to the Model.search_report attr
            
            Args:
                 X: pd.DataFrame with features values
                 y: target column values
                 config: dictionary with a grid of hyperparameters
+                strategy: search strategy, one of
+                    "grid" - exhaustive search over the grid,
+                    "random" - search over n_candidates configurations sampled from the grid,
+                    "halving" - successive halving over the grid, or n_candidates sampled configurations
+                n_candidates: number of configurations to sample, all grid configurations by default
+                resource: budget of the successive halving, "n_samples" (train rows), or "n_estimators"
+                early_stopping_rounds: number of rounds without the validation score improvement
+                    to stop every candidate training, the validation fold of 20% rows is held out of the search
+                journal: path to the trials journal to resume the search from, json lines file,
+                    every evaluated candidate is appended to the journal and skipped by the restarted search
+                    with the same data, grid and options; supported by the grid and random strategies
+
+           The candidates are trained one after another with all threads on the quantized matrices
+           if the model is defined with quantized=True, the n_jobs setting is ignored then.
 
            Returns: 
                 namedtuple with metrics values: 
                     "mse": float
+
+           Raises:
+                ValueError, unknown search strategy, or resource, or the journal is used with halving
         """
+        if strategy not in SEARCH_STRATEGIES:
+            raise ValueError(f"Unknown search strategy '{strategy}'. "
+                             f"Available strategies: {', '.join(SEARCH_STRATEGIES)}")
+        if resource not in SEARCH_RESOURCES:
+            raise ValueError(f"Unknown search resource '{resource}'. "
+                             f"Available resources: {', '.join(SEARCH_RESOURCES)}")
+        if journal is not None and strategy == "halving":
+            raise ValueError("The trials journal is supported by the grid and random search strategies")
+        if self.quantized and strategy == "halving":
+            raise ValueError("The quantized training is supported by the grid and random search strategies")
+
         if self.model is None:
             self._model_definition(config=None)
         
-        grid = GridSearchCV(estimator=self.model,
-                            param_grid=config,
-                            scoring='neg_mean_squared_error',
-                            cv=2,
-                            n_jobs=-1,
-                            verbose=2)
-        # find best tuned estimator
-        grid.fit(X, y)
-        self.model = grid.best_estimator_
+        n_jobs = -1 if self.n_jobs is None else self.n_jobs
+        # split the threads between the parallel candidates to avoid the CPUs oversubscription
+        if self.nthread is not None:
+            self.model.set_params(n_jobs=max(self.nthread // max(n_jobs, 1), 1))
+
+        X_search, y_search, fit_params = X, y, {}
+        if early_stopping_rounds:
+            X_search, X_val, y_search, y_val = train_test_split(X, y,
+                                                                test_size=0.2,
+                                                                random_state=2019)
+            self.model.set_params(early_stopping_rounds=early_stopping_rounds)
+            fit_params = {"eval_set": [(X_val, y_val)],
+                          "verbose": False}
+
+        search_options = {"estimator": self.model,
+                          "scoring": 'neg_mean_squared_error',
+                          "cv": 2,
+                          "n_jobs": n_jobs,
+                          "refit": False,
+                          "verbose": 2}
+        if journal is not None or self.quantized:
+            if strategy == "grid":
+                candidates = list(ParameterGrid(config))
+            else:
+                candidates = list(ParameterSampler(config,
+                                                   n_iter=n_candidates or len(ParameterGrid(config)),
+                                                   random_state=2019))
+            if journal is not None:
+                # the threads don't affect the scores and the grid overrides the estimator hyperparameters,
+                # hence they're excluded from the fingerprint
+                estimator_params = {k: v for k, v in self.model.get_params().items()
+                                    if k != "n_jobs" and k not in config}
+                key = search_fingerprint(X_search, y_search, config,
+                                         options={"strategy": strategy,
+                                                  "cv": search_options["cv"],
+                                                  "quantized": self.quantized,
+                                                  "estimator": estimator_params})
+        elif strategy == "grid":
+            grid = GridSearchCV(param_grid=config,
+                                **search_options)
+        elif strategy == "random":
+            grid = RandomizedSearchCV(param_distributions=config,
+                                      n_iter=n_candidates or len(ParameterGrid(config)),
+                                      random_state=2019,
+                                      **search_options)
+        else:
+            halving_options = {"resource": resource,
+                               "factor": 3,
+                               "min_resources": "exhaust",
+                               "random_state": 2019}
+            # the number of trees is the budget, hence it's excluded from the grid
+            if resource == "n_estimators":
+                halving_options["max_resources"] = max(config.get("n_estimators",
+                                                                  [self.model.get_params()["n_estimators"] or 100]))
+                config = {k: v for k, v in config.items() if k != "n_estimators"}
+            if n_candidates is None:
+                grid = HalvingGridSearchCV(param_grid=config,
+                                           **halving_options,
+                                           **search_options)
+            else:
+                grid = HalvingRandomSearchCV(param_distributions=config,
+                                             n_candidates=n_candidates,
+                                             **halving_options,
+                                             **search_options)
+
+        # find best tuned configuration
+        t0 = time.time()
+        if self.quantized:
+            # the candidates are trained one after another with all threads on the matrices
+            # built once, the quantiles are sketched on the full data set and reused by the folds
+            dtrain, folds = booster_template.quantize_folds(X, y,
+                                                            n_splits=search_options["cv"],
+                                                            max_bin=self.model.get_params().get("max_bin"),
+                                                            X_search=X_search,
+                                                            y_search=y_search,
+                                                            eval_set=fit_params.get("eval_set"))
+            self.model.set_params(n_jobs=self.nthread)
+            evaluate, batch_size = partial(booster_template.evaluate_quantized, self.model, folds), 1
+
+        with shared_data(X_search, y_search, fit_params,
+                         share=not self.quantized and effective_n_jobs(n_jobs) > 1) as (X_search, y_search, fit_params):
+            if not self.quantized:
+                evaluate = partial(evaluate_candidates, search_options, X_search, y_search, fit_params)
+                batch_size = effective_n_jobs(n_jobs)
+            if journal is not None:
+                cv_results, resumed = self._search_journal(journal, key, candidates, evaluate, batch_size,
+                                                           n_splits=search_options["cv"])
+            elif self.quantized:
+                cv_results = evaluate(candidates)
+            else:
+                grid.fit(X_search, y_search, **fit_params)
+                cv_results, best_params, best_score = grid.cv_results_, grid.best_params_, grid.best_score_
+            if journal is not None or self.quantized:
+                scores = np.nan_to_num(np.asarray(cv_results["mean_test_score"], dtype=np.float64), nan=-np.inf)
+                best_params, best_score = candidates[int(np.argmax(scores))], float(np.max(scores))
+
+        self.search_report = search_report(cv_results, time.time() - t0)
+        self.search_report["best_mse"] = float(-best_score)
+        self.search_report["best_params"] = best_params
+        if journal is not None:
+            self.search_report["resumed"] = resumed
+        # refit the best configuration with all threads
+        self.model.set_params(**best_params, n_jobs=self.nthread, early_stopping_rounds=None)
+        if self.quantized:
+            self._fit_quantized(dtrain)
+        else:
+            self.model.fit(X, y)
+        self.table = None
+        self._compile()
         
         # evalute on train set
         y_pred = self.predict(X)
         model_eval = self.score(y_true=y, y_pred=y_pred)
         return model_eval
 
-    def save(self, path: str):
-        """Model saver method
+    def _search_journal(self,
+                        journal: str,
+                        key: str,
+                        candidates: list,
+                        evaluate: Callable[[List[dict]], dict],
+                        batch_size: int,
+                        n_splits: int) -> Tuple[dict, int]:
+        """Function to evaluate the search candidates missing in the trials journal
 
-           Args:
-                path: path to save model into 
-        """
-        try:
-            if not os.path.isdir(path):
-                os.makedirs(path)                
-            with open(os.path.join(path, 'model.pkl'), 'wb') as f:
-                pickle.dump(self.model, f)
-        except Exception as ex:
-            raise ex
-
-    def load(self, path: str):
-        """Model loader method
+           The candidates are evaluated in batches, e.g. of the number of parallel jobs,
+           the trials of every batch are appended to the journal once the batch is evaluated.
 
            Args:
-                path: path to save model into 
-        """
-        try:
-            with open(path, 'rb') as f:
-                self.model = pickle.load(f)
-        except Exception as ex:
-            raise ex
+                journal: path to the trials journal, json lines file
+                key: search fingerprint
+                candidates: list of the candidates hyperparameters
+                evaluate: function to evaluate the list of candidates
+                batch_size: number of candidates per batch
+                n_splits: number of cross-validation folds
 
-    def predict(self, X: pd.DataFrame):
-        """Predict method
-
-           Args:
-                X: pd.DataFrame with features values
+           Returns:
+                tuple with the search results of all candidates in the cv_results_ format
+                and the number of candidates read from the journal
         """
-        if self.model is None:
-            return None
-        try:
-            return self.model.predict(X)
-        except Exception as ex:
-            raise ex
-            return None
+        trials = load_trials(journal, key)
+        # terminate the line truncated by the interrupted job
+        if os.path.isfile(journal) and os.path.getsize(journal):
+            with open(journal, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+        pending = [i for i in candidates if candidate_id(i) not in trials]
+        for i in range(0, len(pending), batch_size):
+            batch = pending[i:i + batch_size]
+            cv_results = evaluate(batch)
+            with open(journal, 'a') as f:
+                for j, params in enumerate(batch):
+                    trial = {"key": key,
+                             "candidate": candidate_id(params),
+                             "params": params,
+                             "fold_mse": [-float(cv_results[f"split{k}_test_score"][j])
+                                          for k in range(n_splits)],
+                             "mean_fit_time": float(cv_results["mean_fit_time"][j]),
+                             "mean_score_time": float(cv_results["mean_score_time"][j])}
+                    f.write(json.dumps(trial, default=str) + "\n")
+                    trials[trial["candidate"]] = trial
+                f.flush()
+                os.fsync(f.fileno())
+
+        trials = [trials[candidate_id(i)] for i in candidates]
+        cv_results = {"params": candidates,
+                      "mean_fit_time": [i["mean_fit_time"] for i in trials],
+                      "mean_score_time": [i["mean_score_time"] for i in trials],
+                      "mean_test_score": [-np.mean(i["fold_mse"]) for i in trials]}
+        for k in range(n_splits):
+            cv_results[f"split{k}_test_score"] = [-i["fold_mse"][k] for i in trials]
+        return cv_results, len(candidates) - len(pending)
@@ -2,31 +2,30 @@
 # www.dkisler.com
 
 import os
-from typing import Tuple, NamedTuple
+from typing import NamedTuple
 import pandas as pd
 import numpy as np
-import pickle
-from sklearn import metrics
-from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import GridSearchCV, ParameterGrid
 import xgboost
 import importlib.util
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
-# import model abstract class
-module_name = "model_template"
+# import xgboost model definition class
+module_name = "booster_template"
 file_path = os.path.join(os.path.dirname(
     os.path.dirname(os.path.abspath(__file__))),
     f"{module_name}.py")
 spec = importlib.util.spec_from_file_location(module_name, file_path)
-model_template = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(model_template)
+booster_template = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(booster_template)
+model_template = booster_template.model_template
 
 
 data_preparation = model_template.data_preparation
 
 
-class Model(model_template.Model):
+class Model(booster_template.Model):
     """"Model definition class"""
     CONFIG = {
         "learning_rate": 0.1,
@@ -35,10 +34,6 @@ class Model(model_template.Model):
         "reg_gamma": 0.8
     }
     
-    def __init__(self,
-                 model=None):
-        self.model = model
-
     def _model_definition(self, 
                           config=CONFIG):
         """Function to define and compile the model
@@ -51,34 +46,13 @@ class Model(model_template.Model):
         """
         if self.model is None:
             if config is None:
-                self.model = xgboost.XGBRegressor(objective='reg:squarederror')
+                self.model = xgboost.XGBRegressor(objective='reg:squarederror',
+                                                  n_jobs=self.nthread)
             else:
                 self.model = xgboost.XGBRegressor(**config, 
-                                                  objective='reg:squarederror')
-
-    def train(self,
-              X: pd.DataFrame,
-              y: pd.Series) -> NamedTuple('model_eval',
-                                          mse=float):
-        """Train method
-
-           Args:
-                X: pd.DataFrame with features values
-                y: target column values
-
-           Returns: 
-                namedtuple with metrics values: 
-                    "mse": float
-        """
-        if self.model is None:
-            self._model_definition()
+                                                  objective='reg:squarederror',
+                                                  n_jobs=self.nthread)
 
-        self.model.fit(X, y)
-        # evalute on train set
-        y_pred = self.predict(X)
-        model_eval = self.score(y_true=y, y_pred=y_pred)
-        return model_eval
-    
     def grid_search(self,
                     X: pd.DataFrame,
                     y: pd.Series,
@@ -92,6 +66,9 @@ class Model(model_template.Model):
                 y: target column values
                 config: dictionary with a grid of hyperparameters
 
+           The candidates are trained one after another with all threads on the quantized matrices
+           if the model is defined with quantized=True, the n_jobs setting is ignored then.
+
            Returns: 
                 namedtuple with metrics values: 
                     "mse": float
@@ -99,57 +76,42 @@ class Model(model_template.Model):
         if self.model is None:
             self._model_definition(config=None)
         
-        grid = GridSearchCV(estimator=self.model,
-                            param_grid=config,
-                            scoring='neg_mean_squared_error',
-                            cv=2,
-                            n_jobs=-1,
-                            verbose=2)
-        # find best tuned estimator
-        grid.fit(X, y)
-        self.model = grid.best_estimator_
+        n_jobs = -1 if self.n_jobs is None else self.n_jobs
+        # split the threads between the parallel candidates to avoid the CPUs oversubscription
+        if self.nthread is not None:
+            self.model.set_params(n_jobs=max(self.nthread // max(n_jobs, 1), 1))
+
+        if self.quantized:
+            # the quantiles are sketched once on the full data set and reused by the folds
+            dtrain, folds = booster_template.quantize_folds(X, y,
+                                                            n_splits=2,
+                                                            max_bin=self.model.get_params().get("max_bin"))
+            self.model.set_params(n_jobs=self.nthread)
+            candidates = list(ParameterGrid(config))
+            # find best tuned configuration
+            cv_results = booster_template.evaluate_quantized(self.model, folds, candidates)
+            best_params = candidates[int(np.argmax(np.nan_to_num(cv_results["mean_test_score"], nan=-np.inf)))]
+        else:
+            grid = GridSearchCV(estimator=self.model,
+                                param_grid=config,
+                                scoring='neg_mean_squared_error',
+                                cv=2,
+                                n_jobs=n_jobs,
+                                refit=False,
+                                verbose=2)
+            # find best tuned configuration
+            grid.fit(X, y)
+            best_params = grid.best_params_
+        # refit the best configuration with all threads
+        self.model.set_params(**best_params, n_jobs=self.nthread)
+        if self.quantized:
+            self._fit_quantized(dtrain)
+        else:
+            self.model.fit(X, y)
+        self.table = None
+        self._compile()
         
         # evalute on train set
         y_pred = self.predict(X)
         model_eval = self.score(y_true=y, y_pred=y_pred)
         return model_eval
-
-    def save(self, path: str):
-        """Model saver method
-
-           Args:
-                path: path to save model into 
-        """
-        try:
-            if not os.path.isdir(path):
-                os.makedirs(path)                
-            with open(os.path.join(path, 'model.pkl'), 'wb') as f:
-                pickle.dump(self.model, f)
-        except Exception as ex:
-            raise ex
-
-    def load(self, path: str):
-        """Model loader method
-
-           Args:
-                path: path to save model into 
-        """
-        try:
-            with open(path, 'rb') as f:
-                self.model = pickle.load(f)
-        except Exception as ex:
-            raise ex
-
-    def predict(self, X: pd.DataFrame):
-        """Predict method
-
-           Args:
-                X: pd.DataFrame with features values
-        """
-        if self.model is None:
-            return None
-        try:
-            return self.model.predict(X)
-        except Exception as ex:
-            raise ex
-            return None
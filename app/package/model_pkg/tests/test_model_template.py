@@ -6,6 +6,8 @@ import importlib.util
 from types import ModuleType
 import pytest
 import inspect
+import pandas as pd
+import numpy as np
 
 DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -71,3 +73,39 @@ def test_model_eval_elements():
     for i in model_score:
         assert getattr(module.Model.model_eval, i), \
           f"Model eval metric {i} is not implemented"
+
+
+def test_deduplicate():
+    X = pd.DataFrame({"a": [1, 0, 1, 1, 0], "b": [0.5, 0.5, 0.5, 0.2, 0.5]})
+    y = pd.Series([1., 2., 3., 4., 6.], name="cr")
+    X_unique, y_unique, weight, inverse = module.deduplicate(X, y)
+    assert len(X_unique) == 3 and np.array_equal(X_unique.to_numpy()[inverse], X.to_numpy()), \
+        "Identical rows are not collapsed"
+    assert np.array_equal(y_unique.to_numpy()[inverse], [2., 4., 2., 4., 4.]) and weight.sum() == len(X), \
+        "Unique rows target is not the mean target"
+
+    _, y_unique, weight, inverse = module.deduplicate(X, y, sample_weight=[3, 1, 1, 2, 3])
+    assert np.allclose(y_unique.to_numpy()[inverse], [1.5, 5., 1.5, 4., 5.]) and weight.sum() == 10, \
+        "Unique rows target is not the weighted mean target"
+
+
+
+def test_lookup_table():
+    X = np.array([[1, 0.5], [0, 0.5], [1, 0.5], [1, 0.2], [0, np.nan]])
+    predict = lambda x: x[:, 0] + 10 * x[:, 1]
+    table = module.LookupTable.build(X, predict)
+    assert len(table.keys) == 3, \
+        "Table doesn't cover the distinct features vectors"
+
+    X_new = np.array([[1, 0.2], [0, 0.5], [0, 0.2], [2, 0.5], [0, np.nan]])
+    assert np.allclose(table.predict(X_new, predict), predict(X_new), equal_nan=True), \
+        "Table prediction doesn't match the model prediction"
+    assert table.report()["hits"] == 2 and table.report()["misses"] == 3, \
+        "Table lookups are not counted"
+
+    path = "/tmp/table.npz"
+    table.save(path)
+    table_loaded = module.LookupTable.load(path)
+    assert np.array_equal(table_loaded.predict(X, predict), table.predict(X, predict), equal_nan=True), \
+        "Loaded table prediction doesn't match the saved table"
+    os.remove(path)
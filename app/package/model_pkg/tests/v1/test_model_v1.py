@@ -124,6 +124,156 @@ def test_train_model():
         "Model train error"
 
 
+def test_predict_numpy():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+
+    y_pred = model.model.predict(X)
+    assert np.allclose(model.predict(X), y_pred, rtol=0, atol=1e-9), \
+        "Numpy prediction doesn't match the model prediction"
+
+    out = np.empty(len(X))
+    model.predict_array(X.to_numpy(dtype=np.float32), out=out)
+    assert np.allclose(out, model.model.predict(X.astype(np.float32)), rtol=0, atol=1e-9), \
+        "In-place numpy prediction doesn't match the model prediction"
+
+
+def test_predict_chunks():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    X = pd.DataFrame(np.random.randint(0, 2, size=(1000, X.shape[1])), columns=X.columns)
+    X["attrs_scale"] = np.random.rand(1000)
+    model_chunks = module.Model()
+    model_chunks.train(X, pd.Series(np.random.rand(1000)))
+
+    y_pred = model_chunks.predict(X)
+    for chunk_rows in (7, 331):
+        y_pred_chunks = np.concatenate([model_chunks.predict(X.iloc[i:i + chunk_rows].copy())
+                                        for i in range(0, len(X), chunk_rows)])
+        assert np.array_equal(y_pred_chunks, y_pred), \
+            f"Prediction in chunks of {chunk_rows} rows doesn't match the prediction of all rows"
+
+    X = pd.concat([X, X.iloc[::3]], ignore_index=True)
+    y_pred = model_chunks.predict(X)
+    codes, uniques = pd.factorize(pd.util.hash_pandas_object(X, index=False).to_numpy())
+    index = np.empty(len(uniques), dtype=np.int64)
+    index[codes] = np.arange(len(codes))
+    assert np.array_equal(model_chunks.predict(X.iloc[index])[codes], y_pred), \
+        "Prediction of the unique rows scattered back doesn't match the prediction of all rows"
+
+
+def test_partial_fit():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    X = pd.DataFrame(np.random.rand(100, X.shape[1]), columns=X.columns)
+    y = pd.Series(np.random.rand(100))
+
+    model_full = module.Model()
+    model_score = model_full.train(X, y)
+    model_partial = module.Model()
+    for i in range(0, 100, 30):
+        model_partial_score = model_partial.partial_fit(X.iloc[i:i + 30], y.iloc[i:i + 30])
+    assert np.allclose(model_partial.model.coef_, model_full.model.coef_) and \
+        np.isclose(model_partial.model.intercept_, model_full.model.intercept_), \
+        "Model trained chunk by chunk doesn't match the model trained at once"
+    assert np.isclose(model_partial_score.mse, model_score.mse), \
+        "Model score calculated from the statistics doesn't match the model score"
+
+    path = "/tmp/model_partial_v1"
+    model_previous = module.Model()
+    model_previous.train(X.iloc[:70], y.iloc[:70])
+    model_previous.save(path)
+    model_warm = module.Model()
+    model_warm.warm_start(X.iloc[70:], y.iloc[70:], path)
+    assert np.allclose(model_warm.predict(X), model_full.predict(X)), \
+        "Updated previous model doesn't match the model trained at once"
+
+    sample_weight = np.random.randint(1, 10, 100)
+    model_full.train(X, y, sample_weight=sample_weight)
+    model_partial = module.Model()
+    for i in range(0, 100, 30):
+        model_partial.partial_fit(X.iloc[i:i + 30], y.iloc[i:i + 30], sample_weight=sample_weight[i:i + 30])
+    assert np.allclose(model_partial.predict(X), model_full.predict(X)), \
+        "Weighted model trained chunk by chunk doesn't match the weighted model trained at once"
+    model_previous.train(X.iloc[:70], y.iloc[:70], sample_weight=sample_weight[:70])
+    model_previous.save(path)
+    model_warm.warm_start(X.iloc[70:], y.iloc[70:], path, sample_weight=sample_weight[70:])
+    assert np.allclose(model_warm.predict(X), model_full.predict(X)), \
+        "Weighted update of the previous model doesn't match the weighted model trained at once"
+
+    with pytest.raises(ValueError):
+        model_warm.partial_fit(X.iloc[:, 1:], y)
+    model_legacy = module.Model(model=model_full.model)
+    model_legacy.predict(X)
+    with pytest.raises(ValueError):
+        model_legacy.partial_fit(X, y)
+
+
+def test_dedup():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    X = pd.DataFrame(np.random.randint(0, 2, size=(100, X.shape[1])), columns=X.columns)
+    X = pd.concat([X, X.iloc[:50]], ignore_index=True)
+    y = pd.Series(np.random.rand(150))
+    sample_weight = np.random.randint(1, 10, 150)
+
+    for weight in (None, sample_weight):
+        model_full = module.Model()
+        model_score = model_full.train(X, y, sample_weight=weight)
+        model_dedup = module.Model(dedup=True)
+        model_dedup_score = model_dedup.train(X, y, sample_weight=weight)
+        assert model_dedup.train_report["unique_rows"] < model_dedup.train_report["rows"], \
+            "Identical rows are not collapsed"
+        assert np.allclose(model_dedup.predict(X), model_full.predict(X), atol=1e-12), \
+            "Model trained on the unique rows doesn't match the model trained on all rows"
+        assert np.isclose(model_dedup_score.mse, model_score.mse), \
+            "Model score on the unique rows doesn't match the model score on all rows"
+
+        assert np.isclose(model_dedup.stats["yy"], model_full.stats["yy"]), \
+            "Sufficient statistics of the unique rows don't match the statistics of all rows"
+
+
+def test_tabulate():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    X = pd.DataFrame(np.random.randint(0, 2, size=(100, X.shape[1])), columns=X.columns)
+    y = pd.Series(np.random.rand(100))
+    model_table = module.Model()
+    model_table.train(X, y)
+    y_pred = model_table.predict(X)
+    X_new = X.copy()
+    X_new.iloc[:10, 0] = 2
+    y_pred_new = model_table.predict(X_new)
+
+    report = model_table.tabulate(X.iloc[:50])
+    assert report["entries"] == len(X.iloc[:50].drop_duplicates()), \
+        "Table doesn't cover the distinct features vectors"
+    assert np.allclose(model_table.predict(X), y_pred), \
+        "Table prediction doesn't match the model prediction"
+    assert model_table.table.report()["hits"] >= 50, \
+        "Table lookups are not counted"
+    assert np.allclose(model_table.predict(X_new), y_pred_new), \
+        "Prediction of the features vectors missing in the table doesn't match the model prediction"
+
+    path = "/tmp/table_v1"
+    model_table.save(path)
+    model_loaded = module.Model()
+    model_loaded.load(path)
+    assert model_loaded.table is not None and np.array_equal(model_loaded.predict(X), model_table.predict(X)), \
+        "Loaded table prediction doesn't match the saved table"
+    model_loaded.train(X, y)
+    assert model_loaded.table is None, \
+        "Table is not dropped when the model is trained again"
+    for f in os.listdir(path):
+        os.remove(os.path.join(path, f))
+    os.rmdir(path)
+
+
 def test_save_model():
     try:
         model.save('/tmp')
@@ -134,13 +284,36 @@ def test_save_model():
 
 
 def test_load_model():
-    path = "/tmp/model.pkl"
+    path = "/tmp/model.json"
     if not os.path.isfile(path):
         return
+    X, y, err = module.data_preparation(DATASET)
+    y_pred = model.predict(X)
     try:
         model.load(path)
     except IOError as ex:
         print(f"Cannoe read model from {path}.\nError: {ex}")
     except Exception as ex:
         raise Exception(ex)
+    assert np.array_equal(model.predict(X), y_pred), \
+        "Loaded model prediction doesn't match the saved model"
     os.remove(path)
+    os.remove("/tmp/coef.npy")
+    os.remove("/tmp/stats.npz")
+
+
+PATH_MODELS_SHIPPED = [DIR.parents[2] / "bucket" / "model" / SUFFIX,
+                       DIR.parents[2] / "smoke_test" / "model" / SUFFIX]
+
+
+@pytest.mark.parametrize("path", PATH_MODELS_SHIPPED)
+def test_load_model_pkl(path):
+    if not path.is_dir():
+        pytest.skip(f"Shipped model {path} is not available")
+    X, y, err = module.data_preparation(DATASET)
+    model_pkl = module.Model()
+    model_pkl.load(str(path / "model.pkl"))
+    model_artifact = module.Model()
+    model_artifact.load(str(path / "model.json"))
+    assert np.array_equal(model_pkl.predict(X), model_artifact.predict(X)), \
+        "Legacy pickled model prediction doesn't match the converted model artifact"
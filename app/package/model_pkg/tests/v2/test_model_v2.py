@@ -2,6 +2,7 @@
 # www.dkisler.com
 
 import os
+import pickle
 import pytest
 from io import StringIO
 from pathlib import Path
@@ -143,6 +144,321 @@ def test_grid_search():
         "Model gridSearch error"
 
 
+def test_grid_search_strategies():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    X = pd.DataFrame(np.random.randint(0, 2, size=(60, X.shape[1])), columns=X.columns)
+    y = pd.Series(np.random.rand(60))
+
+    grid_config = {
+        "learning_rate": [0.1, 1],
+        "n_estimators": [3, 9],
+        "max_depth": [1, 2]
+    }
+    for strategy, options in [("random", {"n_candidates": 3}),
+                              ("halving", {"resource": "n_samples"}),
+                              ("halving", {"resource": "n_estimators", "n_candidates": 2}),
+                              ("grid", {"early_stopping_rounds": 2})]:
+        model_search = module.Model()
+        model_score = model_search.grid_search(X, y, grid_config, strategy=strategy, **options)
+        assert model_score.mse >= 0, \
+            f"Model {strategy} search error"
+        assert model_search.search_report["progress"], \
+            f"Model {strategy} search report is empty"
+        assert model_search.model.get_params()["early_stopping_rounds"] is None, \
+            "Early stopping is not reset for the refit"
+
+    with pytest.raises(ValueError):
+        module.Model().grid_search(X, y, grid_config, strategy="bayes")
+
+
+def test_grid_search_journal():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    X = pd.DataFrame(np.random.randint(0, 2, size=(60, X.shape[1])), columns=X.columns)
+    y = pd.Series(np.random.rand(60))
+
+    grid_config = {
+        "learning_rate": [0.1, 1],
+        "n_estimators": [3, 9],
+        "max_depth": [1, 2]
+    }
+    path = "/tmp/trials.jsonl"
+    if os.path.isfile(path):
+        os.remove(path)
+
+    model_search = module.Model()
+    model_score = model_search.grid_search(X, y, grid_config)
+
+    model_journal = module.Model()
+    model_journal_score = model_journal.grid_search(X, y, grid_config, journal=path)
+    assert model_journal.search_report["best_params"] == model_search.search_report["best_params"], \
+        "Journaled search best configuration doesn't match the grid search"
+    assert model_journal_score == model_score, \
+        "Journaled search model score doesn't match the grid search"
+    with open(path) as f:
+        assert len(f.readlines()) == 8, \
+            "Not all trials are in the journal"
+
+    # the job interrupted while writing the journal
+    with open(path) as f:
+        trials = f.readlines()
+    with open(path, 'w') as f:
+        f.writelines(trials[:5])
+        f.write(trials[5][:20])
+    model_resumed = module.Model()
+    model_resumed_score = model_resumed.grid_search(X, y, grid_config, journal=path)
+    assert model_resumed.search_report["resumed"] == 5, \
+        "Completed trials are not skipped"
+    assert model_resumed_score == model_score, \
+        "Resumed search model score doesn't match the grid search"
+
+    model_resumed.grid_search(X, y, grid_config, journal=path)
+    assert model_resumed.search_report["resumed"] == 8, \
+        "Trials appended after the interrupted write are not read"
+    os.remove(path)
+
+
+def test_grid_search_shared_data():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    X = pd.DataFrame(np.random.randint(0, 2, size=(60, X.shape[1])), columns=X.columns)
+    y = pd.Series(np.random.rand(60))
+
+    with module.shared_data(X, y, {"eval_set": [(X, y)]}) as (X_shared, y_shared, fit_params):
+        path = X_shared.filename
+        assert isinstance(X_shared, np.memmap) and isinstance(fit_params["eval_set"][0][0], np.memmap), \
+            "Data set is not memory-mapped"
+        assert np.array_equal(X_shared, X.to_numpy(dtype=np.float32)) and np.array_equal(y_shared, y), \
+            "Memory-mapped data set doesn't match the data set"
+    assert not os.path.isfile(path), \
+        "Memory-mapped data set is not removed"
+
+    grid_config = {
+        "learning_rate": [0.1, 1],
+        "max_depth": [1, 2]
+    }
+    model_serial = module.Model(n_jobs=1)
+    model_parallel = module.Model(n_jobs=2)
+    assert model_serial.grid_search(X, y, grid_config) == model_parallel.grid_search(X, y, grid_config), \
+        "Parallel search with the shared data set doesn't match the serial search"
+
+
+def test_quantized():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    X = pd.DataFrame(np.random.randint(0, 2, size=(60, X.shape[1])), columns=X.columns)
+    y = pd.Series(np.random.rand(60))
+
+    model_hist = module.Model()
+    model_hist._model_definition()
+    model_hist.model.set_params(tree_method="hist")
+    model_score = model_hist.train(X, y)
+    model_quantized = module.Model(quantized=True)
+    assert np.isclose(model_quantized.train(X, y).mse, model_score.mse), \
+        "Quantized model score doesn't match the model score"
+
+    grid_config = {
+        "learning_rate": [0.1, 1],
+        "n_estimators": [3, 9],
+        "max_depth": [1, 2]
+    }
+    for strategy, options in [("grid", {}),
+                              ("random", {"n_candidates": 3, "early_stopping_rounds": 2})]:
+        model_search = module.Model(model=module.xgboost.XGBRegressor(tree_method="hist"), n_jobs=1)
+        model_score = model_search.grid_search(X, y, grid_config, strategy=strategy, **options)
+        model_quantized = module.Model(quantized=True)
+        model_quantized_score = model_quantized.grid_search(X, y, grid_config, strategy=strategy, **options)
+        assert model_quantized.search_report["best_params"] == model_search.search_report["best_params"], \
+            f"Quantized {strategy} search best configuration doesn't match the search"
+        assert np.isclose(model_quantized_score.mse, model_score.mse), \
+            f"Quantized {strategy} search model score doesn't match the search"
+
+    with pytest.raises(ValueError):
+        module.Model(quantized=True).grid_search(X, y, grid_config, strategy="halving")
+
+
+def test_early_stopping():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    X = pd.DataFrame(np.random.randint(0, 2, size=(60, X.shape[1])), columns=X.columns)
+    y = pd.Series(np.random.rand(60))
+
+    for quantized in (False, True):
+        model_es = module.Model(quantized=quantized)
+        model_es._model_definition(config={"n_estimators": 50, "learning_rate": 1, "max_depth": 3})
+        model_es.train(X.iloc[:40], y.iloc[:40], eval_set=(X.iloc[40:], y.iloc[40:]), early_stopping_rounds=2)
+        report = model_es.train_report
+        assert report["best_iteration"] is not None and report["trees"] == report["best_iteration"] + 1, \
+            "Trees after the best iteration are not dropped"
+        assert report["rounds"] <= report["trees"] + 2 < report["n_estimators"], \
+            "Training is not stopped early"
+        assert model_es.booster.num_boosted_rounds() == report["trees"], \
+            "Prediction doesn't use the best iteration trees only"
+
+        path = f"/tmp/model_es_{SUFFIX}"
+        model_es.save(path)
+        model_loaded = module.Model()
+        model_loaded.load(path)
+        assert model_loaded.train_report == report, \
+            "Training report is not saved with the model"
+        assert np.array_equal(model_loaded.predict(X), model_es.predict(X)), \
+            "Loaded model prediction doesn't match the model prediction"
+
+    model_es.train(X, y)
+    assert model_es.train_report["best_iteration"] is None and model_es.train_report["trees"] == 50, \
+        "Model is trained with early stopping without the validation set"
+    model_es.train(X.iloc[:40], y.iloc[:40], eval_set=(X.iloc[40:], y.iloc[40:]))
+    assert model_es.train_report["best_iteration"] is None and model_es.train_report["trees"] == 50, \
+        "Model is trained with early stopping by default"
+
+
+def test_warm_start():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    X = pd.DataFrame(np.random.randint(0, 2, size=(60, X.shape[1])), columns=X.columns)
+    y = pd.Series(np.random.rand(60))
+
+    path = f"/tmp/model_warm_start_{SUFFIX}"
+    model_previous = module.Model()
+    model_previous._model_definition(config={"n_estimators": 6, "max_depth": 2})
+    model_previous.train(X, y)
+    model_previous.save(path)
+
+    for quantized in (False, True):
+        model_warm = module.Model(quantized=quantized)
+        model_warm._model_definition(config={"n_estimators": 6, "max_depth": 2})
+        model_score = model_warm.warm_start(X, y, path, n_estimators=4)
+        assert model_warm.booster.num_boosted_rounds() == 10, \
+            "Trees are not added to the previous model"
+        assert np.array_equal(model_warm.predict_array(X.to_numpy(dtype=np.float32), iteration_range=(0, 6)),
+                              model_previous.predict(X)), \
+            "Previous model trees are changed"
+        assert model_score.mse <= model_previous.score(y, model_previous.predict(X)).mse, \
+            "Warm started model score is worse than the previous model score"
+        assert model_warm.model.get_params()["n_estimators"] == 6, \
+            "Model hyperparameters are changed"
+
+    model_warm.warm_start(X, y, path, n_estimators=4, max_trees=8)
+    assert model_warm.train_report["trees"] == 8 and model_warm.train_report["pruned"] == 0, \
+        "Number of trees is not capped"
+    model_warm.warm_start(X, y, path, n_estimators=4, max_trees=8, prune=True)
+    assert model_warm.train_report["trees"] == 8 and model_warm.train_report["pruned"] == 2, \
+        "Oldest trees are not pruned"
+
+    # the rows with zero weight don't contribute to the new trees
+    sample_weight = np.tile([0, 1], 30)
+    model_weighted = module.Model()
+    model_weighted._model_definition(config={"n_estimators": 6, "max_depth": 2})
+    model_weighted.warm_start(X, y, path, n_estimators=4, sample_weight=sample_weight)
+    model_subset = module.Model()
+    model_subset._model_definition(config={"n_estimators": 6, "max_depth": 2})
+    model_subset.warm_start(X[sample_weight > 0], y[sample_weight > 0], path, n_estimators=4)
+    assert np.allclose(model_weighted.predict(X), model_subset.predict(X), rtol=0, atol=1e-6), \
+        "Rows weights are not used by the warm started model"
+
+    with pytest.raises(ValueError):
+        model_warm.warm_start(X.iloc[:, 1:], y, path)
+
+
+def test_dedup():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    # the rows gradients are stored in float32, hence the unique weighted rows may break the split ties
+    # differently from the repeated rows, the fixture and the exact shallow trees keep the ties apart
+    rng = np.random.default_rng(2019)
+    X = pd.DataFrame(rng.integers(0, 2, size=(100, X.shape[1])), columns=X.columns)
+    X = pd.concat([X, X.iloc[:50]], ignore_index=True)
+    y = pd.Series(rng.random(150))
+    sample_weight = rng.integers(1, 10, 150)
+    config = {"n_estimators": 10, "max_depth": 3, "tree_method": "exact"}
+
+    for weight in (None, sample_weight):
+        model_full = module.Model()
+        model_full._model_definition(config=config)
+        model_score = model_full.train(X, y, sample_weight=weight)
+        model_dedup = module.Model(dedup=True)
+        model_dedup._model_definition(config=config)
+        model_dedup_score = model_dedup.train(X, y, sample_weight=weight)
+        assert model_dedup.train_report["unique_rows"] < model_dedup.train_report["rows"], \
+            "Identical rows are not collapsed"
+        assert np.allclose(model_dedup.predict(X), model_full.predict(X), atol=1e-6), \
+            "Model trained on the unique rows doesn't match the model trained on all rows"
+        assert np.isclose(model_dedup_score.mse, model_score.mse), \
+            "Model score on the unique rows doesn't match the model score on all rows"
+
+
+def test_predict_inplace():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+
+    assert np.array_equal(model.predict(X), model.model.predict(X)), \
+        "Inplace prediction doesn't match the model prediction"
+
+    model_threads = module.Model(model=model.model, nthread=1)
+    assert np.array_equal(model_threads.predict_array(X.to_numpy(dtype=np.float32), iteration_range=(0, 1)),
+                          model.model.predict(X, iteration_range=(0, 1))), \
+        "Inplace prediction with iteration range doesn't match the model prediction"
+
+
+def test_set_threads():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+
+    y_pred = model.predict(X)
+    model.set_threads(nthread=1, n_jobs=1)
+    assert model.model.get_params()["n_jobs"] == 1, \
+        "Estimator threads are not set"
+    assert np.array_equal(model.predict(X), y_pred), \
+        "Prediction changed with the threads setting"
+
+
+def test_tabulate():
+    X, y, err = module.data_preparation(DATASET)
+    if err:
+        assert Exception(err)
+    X = pd.DataFrame(np.random.randint(0, 2, size=(100, X.shape[1])), columns=X.columns)
+    y = pd.Series(np.random.rand(100))
+    model_table = module.Model()
+    model_table.train(X, y)
+    y_pred = model_table.predict(X)
+    X_new = X.copy()
+    X_new.iloc[:10, 0] = 2
+    y_pred_new = model_table.predict(X_new)
+
+    report = model_table.tabulate(X.iloc[:50])
+    assert report["entries"] == len(X.iloc[:50].drop_duplicates()), \
+        "Table doesn't cover the distinct features vectors"
+    assert np.array_equal(model_table.predict(X), y_pred), \
+        "Table prediction doesn't match the model prediction"
+    assert model_table.table.report()["hits"] >= 50, \
+        "Table lookups are not counted"
+    assert np.array_equal(model_table.predict(X_new), y_pred_new), \
+        "Prediction of the features vectors missing in the table doesn't match the model prediction"
+
+    path = "/tmp/table_v2"
+    model_table.save(path)
+    model_loaded = module.Model()
+    model_loaded.load(path)
+    assert model_loaded.table is not None and np.array_equal(model_loaded.predict(X), model_table.predict(X)), \
+        "Loaded table prediction doesn't match the saved table"
+    model_loaded.train(X, y)
+    assert model_loaded.table is None, \
+        "Table is not dropped when the model is trained again"
+    for f in os.listdir(path):
+        os.remove(os.path.join(path, f))
+    os.rmdir(path)
+
+
 def test_save_model():
     try:
         model.save('/tmp')
@@ -153,13 +469,50 @@ def test_save_model():
 
 
 def test_load_model():
-    path = "/tmp/model.pkl"
+    path = "/tmp/model.json"
     if not os.path.isfile(path):
         return
+    X, y, err = module.data_preparation(DATASET)
+    y_pred = model.predict(X)
     try:
         model.load(path)
     except IOError as ex:
         print(f"Cannoe read model from {path}.\nError: {ex}")
     except Exception as ex:
         raise Exception(ex)
+    assert np.array_equal(model.predict(X), y_pred), \
+        "Loaded model prediction doesn't match the saved model"
     os.remove(path)
+    os.remove("/tmp/booster.ubj")
+
+
+def test_load_model_pkl():
+    path = "/tmp/model.pkl"
+    with open(path, 'wb') as f:
+        pickle.dump(model.model, f)
+    X, y, err = module.data_preparation(DATASET)
+    model_pkl = module.Model()
+    model_pkl.load(path)
+    assert np.array_equal(model_pkl.predict(X), model.predict(X)), \
+        "Pickled model prediction doesn't match the model"
+    os.remove(path)
+
+
+PATH_MODEL_SHIPPED = DIR.parents[2] / "bucket" / "model" / SUFFIX
+
+
+def test_load_model_pkl_legacy():
+    if not PATH_MODEL_SHIPPED.is_dir():
+        pytest.skip(f"Shipped model {PATH_MODEL_SHIPPED} is not available")
+    X, y, err = module.data_preparation(DATASET)
+    model_artifact = module.Model()
+    model_artifact.load(str(PATH_MODEL_SHIPPED / "model.json"))
+    model_pkl = module.Model()
+    if int(module.xgboost.__version__.split('.')[0]) >= 3:
+        # the xgboost<1.0 binary model format is not supported since xgboost 3
+        with pytest.raises(ValueError):
+            model_pkl.load(str(PATH_MODEL_SHIPPED / "model.pkl"))
+        return
+    model_pkl.load(str(PATH_MODEL_SHIPPED / "model.pkl"))
+    assert np.array_equal(model_pkl.predict(X), model_artifact.predict(X)), \
+        "Legacy pickled model prediction doesn't match the converted model artifact"
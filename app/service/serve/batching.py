@@ -0,0 +1,192 @@
+# Dmitry Kisler © 2019
+# www.dkisler.com
+
+import asyncio
+from collections import Counter
+from concurrent.futures import Executor
+from typing import Callable, List, Tuple
+import pandas as pd
+
+
+class MicroBatcher:
+    """Scheduler to group concurrent prediction requests into vectorized batches"""
+
+    def __init__(self,
+                 predict: Callable[[pd.DataFrame], pd.DataFrame],
+                 executor: Executor,
+                 max_rows=256,
+                 max_wait_ms=2.,
+                 max_batches=1):
+        """Instantiate scheduler
+
+            Args:
+                predict: function to score the batch, it must return one row per input row
+                executor: executor to run prediction off the event loop
+                max_rows: max number of rows in the batch
+                max_wait_ms: max time to wait for the batch to fill up after its first request
+                max_batches: max number of batches being scored concurrently
+        """
+        self.predict = predict
+        self.executor = executor
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000
+        self.max_batches = max_batches
+        self.queue = None
+        self.slots = None
+        self.task = None
+        # batches being scored, the references keep the tasks from being garbage collected
+        self.runs = set()
+        # number of submitted requests waiting for the results
+        self.pending = 0
+        # metrics
+        self.queue_depth_max = 0
+        self.batches = 0
+        self.rows = 0
+        self.batch_sizes = Counter()
+        self.batches_failed = 0
+
+    async def start(self):
+        """Function to start the scheduler in the running event loop"""
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.max_batches)
+        self.task = asyncio.ensure_future(self._collect())
+
+    async def stop(self):
+        """Function to stop the scheduler
+
+            The batches being scored are completed, the queued requests fail.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.runs:
+            await asyncio.gather(*self.runs, return_exceptions=True)
+        while self.queue is not None and not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Scheduler is stopped"))
+
+    async def submit(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Function to score the request rows as part of the batch
+
+            Args:
+                df: request rows
+
+            Returns:
+                prediction rows of the request
+
+            Raises:
+                RuntimeError, the scheduler is not running
+        """
+        if self.task is None:
+            raise RuntimeError("Scheduler is not running")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((df, future))
+        self.queue_depth_max = max(self.queue_depth_max, self.queue.qsize())
+        self.pending += 1
+        try:
+            return await future
+        finally:
+            self.pending -= 1
+
+    async def _collect(self):
+        """Function to collect requests into batches until the scheduler is stopped"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            rows = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            try:
+                while rows < self.max_rows:
+                    if self.queue.empty():
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            item = await asyncio.wait_for(self.queue.get(), timeout)
+                        except asyncio.TimeoutError:
+                            break
+                    else:
+                        item = self.queue.get_nowait()
+                    batch.append(item)
+                    rows += len(item[0])
+            except asyncio.CancelledError:
+                # the requests of the batch being collected are not scored
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Scheduler is stopped"))
+                raise
+            task = asyncio.ensure_future(self._run(batch, rows))
+            self.runs.add(task)
+            task.add_done_callback(self.runs.discard)
+
+    async def _run(self,
+                   batch: List[Tuple[pd.DataFrame, asyncio.Future]],
+                   rows: int):
+        """Function to score the batch and fan the results out to the requests
+
+            Args:
+                batch: list of request rows and their futures
+                rows: number of rows in the batch
+        """
+        self.batches += 1
+        self.rows += rows
+        self.batch_sizes[rows] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            df = pd.concat([i[0] for i in batch], ignore_index=True) if len(batch) > 1 else batch[0][0]
+            result = await loop.run_in_executor(self.executor, self.predict, df)
+            offset = 0
+            for request_rows, future in batch:
+                if not future.done():
+                    future.set_result(result.iloc[offset:offset + len(request_rows)].reset_index(drop=True))
+                offset += len(request_rows)
+        except Exception as ex:
+            if len(batch) > 1:
+                self.batches_failed += 1
+            for request_rows, future in batch:
+                if future.done():
+                    continue
+                if len(batch) == 1:
+                    future.set_exception(ex)
+                    continue
+                # rescore every request of the failed batch, so only the faulty requests fail
+                try:
+                    result = await loop.run_in_executor(self.executor, self.predict, request_rows)
+                    future.set_result(result.reset_index(drop=True))
+                except Exception as ex_request:
+                    future.set_exception(ex_request)
+        finally:
+            self.slots.release()
+
+    def absorb(self, other: 'MicroBatcher'):
+        """Function to add the metrics of the stopped scheduler, e.g. of the same model evicted before
+
+            Args:
+                other: stopped scheduler
+        """
+        self.queue_depth_max = max(self.queue_depth_max, other.queue_depth_max)
+        self.batches += other.batches
+        self.rows += other.rows
+        self.batch_sizes.update(other.batch_sizes)
+        self.batches_failed += other.batches_failed
+
+    def report(self) -> dict:
+        """Function to report the scheduler metrics
+
+            Returns:
+                dict with queue depth and batch size metrics
+        """
+        return {"queue_depth": self.queue.qsize() if self.queue is not None else 0,
+                "queue_depth_max": self.queue_depth_max,
+                "batches": self.batches,
+                "batches_failed": self.batches_failed,
+                "batch_rows": self.rows,
+                "batch_size_mean": round(self.rows / self.batches, 2) if self.batches else 0,
+                "batch_size_max": max(self.batch_sizes) if self.batch_sizes else 0,
+                "batch_size_hist": {str(k): v for k, v in sorted(self.batch_sizes.items())}}
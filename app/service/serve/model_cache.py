@@ -0,0 +1,136 @@
+# Dmitry Kisler © 2019
+# www.dkisler.com
+
+import os
+import threading
+import importlib
+from collections import OrderedDict
+from types import ModuleType
+from typing import Tuple, Any
+
+
+class ModelCache:
+    """Thread-safe LRU cache of loaded models of several versions and artifacts"""
+
+    def __init__(self,
+                 package="conversion_rate_model",
+                 max_mb=1024.,
+                 nthread=None):
+        """Instantiate cache
+
+            Args:
+                package: models package name
+                max_mb: memory budget in MB, estimated as the models artifacts size
+                nthread: number of threads to predict with per model call
+        """
+        self.package = package
+        self.nthread = nthread
+        self.max_bytes = max_mb * 2 ** 20
+        self.models = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.loading = {}
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _stamp(path: str) -> Tuple[tuple, int]:
+        """Function to stamp the model artifact files state
+
+            Args:
+                path: path to the model file, manifest, or artifact dir
+
+            Returns:
+                tuple with the files (name, mtime, size) stamp and the artifact size in bytes
+        """
+        if path.endswith('.pkl'):
+            stat = os.stat(path)
+            return ((path, stat.st_mtime_ns, stat.st_size),), stat.st_size
+        path_dir = path if os.path.isdir(path) else os.path.dirname(path)
+        stamp = tuple(sorted((i.name, i.stat().st_mtime_ns, i.stat().st_size)
+                             for i in os.scandir(path_dir) if i.is_file()))
+        return stamp, sum(i[2] for i in stamp)
+
+    def get(self,
+            version: str,
+            path: str) -> Tuple[ModuleType, Any]:
+        """Function to get the loaded model, the model is loaded on a cache miss
+
+            Args:
+                version: model version
+                path: path to the model file, manifest, or artifact dir
+
+            Returns:
+                tuple with the model module and the model object
+
+            Raises:
+                model import, or load error
+        """
+        path = os.path.realpath(path)
+        stamp, size = self._stamp(path)
+        key = (version, path, stamp)
+
+        with self.lock:
+            if key in self.models:
+                self.hits += 1
+                self.models.move_to_end(key)
+                return self.models[key][:2]
+            self.misses += 1
+            # load every model once, even if requested by several threads at once
+            loading = self.loading.setdefault(key, threading.Lock())
+
+        with loading:
+            with self.lock:
+                if key in self.models:
+                    self.models.move_to_end(key)
+                    return self.models[key][:2]
+
+            try:
+                model_definition = importlib.import_module(f"{self.package}.{version}.model")
+                model = model_definition.Model()
+                model.load(path)
+                model.set_threads(nthread=self.nthread)
+            except Exception as ex:
+                with self.lock:
+                    self.loading.pop(key, None)
+                raise ex
+
+            with self.lock:
+                self.loading.pop(key, None)
+                # drop the model loaded from the previous state of the artifact
+                for i in [i for i in self.models if i[:2] == key[:2]]:
+                    self.size -= self.models.pop(i)[2]
+                    self.invalidations += 1
+                self.models[key] = (model_definition, model, size)
+                self.size += size
+                while self.size > self.max_bytes and len(self.models) > 1:
+                    _, (_, _, size_evicted) = self.models.popitem(last=False)
+                    self.size -= size_evicted
+                    self.evictions += 1
+        return model_definition, model
+
+    def loaded(self) -> set:
+        """Function to list the loaded models
+
+            Returns:
+                set of the loaded models (version, path) tuples
+        """
+        with self.lock:
+            return {i[:2] for i in self.models}
+
+    def report(self) -> dict:
+        """Function to report the cache metrics
+
+            Returns:
+                dict with the cache counters and size
+        """
+        with self.lock:
+            return {"models": len(self.models),
+                    "size_mb": round(self.size / 2 ** 20, 2),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "invalidations": self.invalidations}
@@ -0,0 +1,217 @@
+# Dmitry Kisler © 2019
+# www.dkisler.com
+
+import os
+import glob
+import hashlib
+from typing import Callable, Tuple
+import numpy as np
+import pandas as pd
+
+
+def hash_rows(X: pd.DataFrame) -> np.ndarray:
+    """Function to hash the features rows independently of the columns order and dtypes
+
+        Args:
+            X: pd.DataFrame with features values
+
+        Returns:
+            uint64 array with the rows hashes
+    """
+    return pd.util.hash_pandas_object(X[sorted(X.columns)].astype(np.float64),
+                                      index=False).to_numpy()
+
+
+def find_keys(keys: np.ndarray,
+              sorted_keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Function to find the keys in the sorted keys
+
+        Args:
+            keys: keys to find
+            sorted_keys: sorted unique keys to search in
+
+        Returns:
+            tuple with the positions of the keys and the mask of the found keys
+    """
+    if not len(sorted_keys):
+        return np.zeros(len(keys), dtype=np.intp), np.zeros(len(keys), dtype=bool)
+    position = np.searchsorted(sorted_keys, keys)
+    np.minimum(position, len(sorted_keys) - 1, out=position)
+    return position, sorted_keys[position] == keys
+
+
+def artifact_digest(path: str) -> str:
+    """Function to calculate the digest of the model artifact files content
+
+        Args:
+            path: path to the model file, manifest, or artifact dir
+
+        Returns:
+            sha256 hex digest
+    """
+    if path.endswith('.pkl'):
+        files = [path]
+    else:
+        path_dir = path if os.path.isdir(path) else os.path.dirname(path)
+        files = sorted(i.path for i in os.scandir(path_dir) if i.is_file())
+    digest = hashlib.sha256()
+    for file in files:
+        digest.update(os.path.basename(file).encode())
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """Persistent cache of the predictions of the features rows scored by the model artifact
+
+    The entries are stored as a single memory-mapped npy file per model path,
+    the file name contains the artifact digest, hence the entries of the previous
+    state of the artifact are dropped once the artifact changes. The least recently
+    used entries are evicted once the number of entries exceeds the limit.
+    """
+
+    def __init__(self,
+                 path_model: str,
+                 path: str,
+                 max_rows=10_000_000):
+        """Instantiate cache
+
+            Args:
+                path_model: path to the model file, manifest, or artifact dir
+                path: path to the cache dir
+                max_rows: max number of entries to keep
+
+            Raises:
+                IOError, the cache, or the model artifact cannot be read
+        """
+        self.path_model = os.path.realpath(path_model)
+        self.max_rows = max_rows
+        self.name = hashlib.sha1(self.path_model.encode()).hexdigest()[:16]
+        self.digest = artifact_digest(self.path_model)
+        self.path = os.path.join(path, f"{self.name}.{self.digest[:16]}.npy")
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        # drop the entries of the previous state of the artifact
+        for i in glob.glob(os.path.join(path, f"{self.name}.*.npy")):
+            if i != self.path:
+                self.invalidations += len(np.load(i, mmap_mode='r'))
+                os.remove(i)
+
+        self.run = 1
+        self._open()
+        if len(self.keys):
+            self.run = int(self.entries["used"].max()) + 1
+
+    def _open(self):
+        """Function to memory-map the stored entries"""
+        self.entries = None
+        self.keys = np.empty(0, dtype=np.uint64)
+        if os.path.isfile(self.path):
+            self.entries = np.load(self.path, mmap_mode='r')
+            self.keys = np.ascontiguousarray(self.entries["key"])
+        # entries hit in this run, and the entries added in this run sorted by key
+        self.used = np.zeros(len(self.keys), dtype=bool)
+        self.new_keys = np.empty(0, dtype=np.uint64)
+        self.new_values = None
+
+    def predict(self,
+                X: pd.DataFrame,
+                predict: Callable[[pd.DataFrame], np.ndarray]) -> np.ndarray:
+        """Function to predict the features rows with the cache
+
+            Args:
+                X: pd.DataFrame with features values
+                predict: function to predict the features rows missing in the cache
+
+            Returns:
+                array with predictions
+
+            Raises:
+                prediction error
+        """
+        if not len(X):
+            return np.empty(0, dtype=self.entries.dtype["cr"] if self.entries is not None else np.float64)
+        keys = hash_rows(X)
+        position, found = find_keys(keys, self.keys)
+        new_position, new_found = find_keys(keys, self.new_keys)
+        new_found &= ~found
+        missing = ~(found | new_found)
+        n_missing = int(missing.sum())
+
+        y_missing = predict(X.iloc[missing]) if n_missing else None
+        if self.entries is not None:
+            dtype = self.entries.dtype["cr"]
+        elif self.new_values is not None:
+            dtype = self.new_values.dtype
+        else:
+            dtype = y_missing.dtype
+        y_pred = np.empty(len(X), dtype=dtype)
+        if found.any():
+            y_pred[found] = self.entries["cr"][position[found]]
+            self.used[position[found]] = True
+        if new_found.any():
+            y_pred[new_found] = self.new_values[new_position[new_found]]
+        if n_missing:
+            y_pred[missing] = y_missing
+            new_keys, index = np.unique(keys[missing], return_index=True)
+            new_values = np.asarray(y_missing, dtype=dtype)[index]
+            if self.new_values is not None:
+                new_keys = np.concatenate([self.new_keys, new_keys])
+                new_values = np.concatenate([self.new_values, new_values])
+                order = np.argsort(new_keys, kind="stable")
+                new_keys, new_values = new_keys[order], new_values[order]
+            self.new_keys, self.new_values = new_keys, new_values
+
+        self.hits += len(X) - n_missing
+        self.misses += n_missing
+        return y_pred
+
+    def save(self):
+        """Function to store the cache entries, the least recently used entries are evicted over the limit
+
+            Raises:
+                IOError, save error
+        """
+        if self.new_values is None and not self.used.any():
+            return
+        dtype = self.entries.dtype["cr"] if self.entries is not None else self.new_values.dtype
+        entries = np.empty(len(self.keys) + len(self.new_keys),
+                           dtype=[("key", np.uint64), ("cr", dtype), ("used", np.uint32)])
+        if self.entries is not None:
+            entries[:len(self.keys)] = self.entries
+            entries["used"][:len(self.keys)][self.used] = self.run
+        if self.new_values is not None:
+            entries["key"][len(self.keys):] = self.new_keys
+            entries["cr"][len(self.keys):] = self.new_values
+            entries["used"][len(self.keys):] = self.run
+        if len(entries) > self.max_rows:
+            self.evictions += len(entries) - self.max_rows
+            entries = entries[np.argsort(-entries["used"].astype(np.int64), kind="stable")[:self.max_rows]]
+        entries = entries[np.argsort(entries["key"], kind="stable")]
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        path_tmp = f"{self.path}.tmp"
+        with open(path_tmp, 'wb') as f:
+            np.save(f, entries)
+        os.replace(path_tmp, self.path)
+        self._open()
+
+    def report(self) -> dict:
+        """Function to report the cache metrics
+
+            Returns:
+                dict with the cache counters and size
+        """
+        lookups = self.hits + self.misses
+        return {"entries": len(self.keys) + len(self.new_keys),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations}
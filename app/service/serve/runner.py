@@ -3,11 +3,18 @@
 
 import os
 import time
-from typing import Tuple
+import json
+from typing import Tuple, Iterable, Iterator
+from itertools import repeat
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 from service_pkg.logger import getLogger
-from service_pkg.file_io import load_data, save_data
+from service_pkg.file_io import load_data, save_data, load_data_chunks, save_data_chunks, \
+    load_data_range, count_rows, SCHEMAS
+from service_pkg.threads import set_threads
+from prediction_cache import PredictionCache, hash_rows, find_keys, artifact_digest
 import importlib
 import warnings
 warnings.simplefilter(action='ignore', 
@@ -23,7 +30,7 @@ BUCKET_MODEL = "/model"
 PATH_MODEL = os.getenv("PATH_MODEL", 
                        os.path.join(MODEL_VERSION, 
                                     time.strftime('%Y/%m/%d'),
-                                    'model.pkl'))
+                                    'model.json'))
 
 BUCKET_DATA = "/data"
 PATH_DATA_IN = os.getenv("PATH_DATA_IN", 
@@ -36,10 +43,80 @@ PATH_DATA_OUT = os.getenv("PATH_DATA_OUT",
                                        time.strftime('%Y/%m/%d'),
                                        "predict_output.csv.gz"))
 
+# input data schema name to load the data with compact dtypes, see service_pkg.file_io.SCHEMAS
+DATA_SCHEMA = os.getenv("DATA_SCHEMA") or None
+# data format of the input and output files: csv, parquet, feather; defined by the files extensions by default
+DATA_FORMAT = os.getenv("DATA_FORMAT") or None
+
+# number of rows to stream through the model per chunk, 0 to score the whole file at once
+SERVE_CHUNK_ROWS = int(os.getenv("SERVE_CHUNK_ROWS", 0))
+# number of worker processes to score row ranges of the input in parallel
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", 1))
+# score the unique features rows only and scatter the predictions back to the identical rows
+SERVE_DEDUP = os.getenv("SERVE_DEDUP") == "1"
+
+# persistent cache of the predictions of the features rows scored by the model artifact,
+# the rows scored by the same artifact in the previous runs are not scored again
+PREDICTION_CACHE = os.getenv("PREDICTION_CACHE") == "1"
+PREDICTION_CACHE_DIR = os.getenv("PREDICTION_CACHE_DIR",
+                                 os.path.join(BUCKET_MODEL, ".prediction_cache"))
+# max number of cached rows per model, the least recently used rows are evicted
+PREDICTION_CACHE_ROWS = int(os.getenv("PREDICTION_CACHE_ROWS", 10_000_000))
+
+# score the rows new, or changed since the previous day's input only, the predictions of the unchanged rows
+# are carried forward from the previous day's output if it was scored by the same model artifact
+SERVE_DELTA = os.getenv("SERVE_DELTA") == "1"
+# previous day's input and output, the previous day's partitions by default
+PATH_DATA_IN_PREV = os.getenv("PATH_DATA_IN_PREV",
+                              os.path.join("input",
+                                           time.strftime('%Y/%m/%d', time.localtime(time.time() - 86400)),
+                                           "predict_input.csv.gz"))
+PATH_DATA_OUT_PREV = os.getenv("PATH_DATA_OUT_PREV",
+                               os.path.join("output",
+                                            time.strftime('%Y/%m/%d', time.localtime(time.time() - 86400)),
+                                            "predict_output.csv.gz"))
+# metadata file of the output scored in the delta mode, stored next to the output file
+DELTA_META_SUFFIX = ".meta.json"
+
+# the input has one row per entity without the device columns,
+# every row is scored for all devices and the output has a row per entity and device
+SERVE_FANOUT = os.getenv("SERVE_FANOUT") == "1"
+# device columns values of the Computer, Smartphone and Tablet rows, see data_output_sla
+DEVICE_COLUMNS = {"computer": [1, 0, 0],
+                  "smartphone": [0, 1, 0]}
+
+
+def fan_out(df: pd.DataFrame) -> pd.DataFrame:
+    """Function to expand every entity row into the Computer, Smartphone and Tablet rows
+
+    Args:
+        df: input dataframe with one row per entity without the device columns
+
+    Returns:
+        pd.DataFrame with three rows per entity, the device columns follow entity_id
+
+    Raises:
+        ValueError, the input has the device columns
+    """
+    duplicated = [i for i in DEVICE_COLUMNS if i in df.columns]
+    if duplicated:
+        raise ValueError(f"Fan-out input must not contain the device columns: {', '.join(duplicated)}")
+    devices = len(next(iter(DEVICE_COLUMNS.values())))
+    df_devices = df.take(np.repeat(np.arange(len(df)), devices))
+    df_devices.reset_index(drop=True, inplace=True)
+    position = df.columns.get_loc("entity_id") + 1 if "entity_id" in df.columns else 0
+    # the device columns dtype of the expanded input loaded with the same schema, the integers are read as int64
+    schema = SCHEMAS.get(DATA_SCHEMA, {}) if DATA_SCHEMA is not None else {}
+    for i, (column, values) in enumerate(DEVICE_COLUMNS.items()):
+        df_devices.insert(position + i, column, np.tile(np.array(values, dtype=schema.get(column, np.int64)), len(df)))
+    return df_devices
+
 
 def data_output_sla(df: pd.DataFrame,
                     y_pred: pd.Series) -> pd.DataFrame:
     """Function to align prediction output with SLA
+
+    The input dataframe is not modified, hence it doesn't have to be copied.
     
     Args:
         df: intput dataframe 
@@ -48,26 +125,371 @@ def data_output_sla(df: pd.DataFrame,
     Returns:
         pd.DataFrame
     """
-    COL_LOSE = ["computer", "smartphone"]
-    COL_DIMS = ["entity_id", *COL_LOSE]
     COL_TARGET = 'cr'
+    DEVICES = ["Computer", "Smartphone", "Tablet"]
 
-    result = df[COL_DIMS].copy()
-    result["device"] = "Computer"
-    result.loc[result["smartphone"] == 1,
-               "device"] = "Smartphone"
-    result.loc[(result["smartphone"] == 0) & (result["computer"] == 0),
-               "device"] = "Tablet"
-    result[COL_TARGET] = y_pred
-    result.drop(COL_LOSE, axis=1, inplace=True)
-    
-    return result
+    smartphone = df["smartphone"].values
+    computer = df["computer"].values
+    device = np.zeros(len(df), dtype=np.int8)
+    device[(smartphone == 0) & (computer == 0)] = 2
+    device[smartphone == 1] = 1
+
+    entity_id = df["entity_id"].values
+    # the csv columns without rows are read as object, entity_id of the rows is read as int64
+    if not len(df) and entity_id.dtype == object:
+        entity_id = entity_id.astype(np.int64)
+
+    return pd.DataFrame({"entity_id": entity_id,
+                         "device": pd.Categorical.from_codes(device, categories=DEVICES),
+                         COL_TARGET: y_pred},
+                        index=df.index)
+
+
+def empty_output(model,
+                 data_preparation,
+                 path: str) -> pd.DataFrame:
+    """Function to define the output without rows with the output columns and dtypes of the model
+
+    Args:
+        model: model object
+        data_preparation: function to align data with the model requirements
+        path: path to the input data
     
+    Returns:
+        pd.DataFrame without rows
+
+    Raises:
+        read, or prediction error
+    """
+    df, err = load_data_range(path, 0, 0, schema=DATA_SCHEMA, data_format=DATA_FORMAT)
+    if err:
+        raise err
+    return predict_sla(model, data_preparation, df, fanout=SERVE_FANOUT)
+
+
+def predict_unique(model,
+                   X: pd.DataFrame,
+                   report: dict) -> np.ndarray:
+    """Function to score the unique features rows and scatter the predictions back to all rows
+
+    The rows are identified by the hash of the features values,
+    the output order and values are the same as of the model prediction over all rows.
+
+    Args:
+        model: model object
+        X: pd.DataFrame with features values
+        report: dict to accumulate the number of rows, unique rows, dedup and prediction time (sec) into
+
+    Returns:
+        predictions vector
+
+    Raises:
+        prediction error
+    """
+    t0 = time.time()
+    codes, uniques = pd.factorize(pd.util.hash_pandas_object(X, index=False).to_numpy())
+    # any of the identical rows represents its group
+    index = np.empty(len(uniques), dtype=np.int64)
+    index[codes] = np.arange(len(codes))
+    t_dedup = time.time() - t0
+
+    t0 = time.time()
+    y_pred = model.predict(X.iloc[index]) if len(X) else model.predict(X)
+    t_predict = time.time() - t0
+
+    for k, v in (("rows", len(X)),
+                 ("unique_rows", len(index)),
+                 ("dedup_sec", t_dedup),
+                 ("predict_sec", t_predict)):
+        report[k] = report.get(k, 0) + v
+    return y_pred[codes] if len(X) else y_pred
+
+
+def log_dedup(report: dict,
+              logs: getLogger):
+    """Function to log the unique rows ratio and the prediction time saved by deduplication
+
+    The time saved is estimated as the prediction time of the identical rows
+    at the unique rows prediction rate less the dedup time.
+
+    Args:
+        report: dict with the number of rows, unique rows, dedup and prediction time, see predict_unique
+        logs: logger object
+    """
+    if not report.get("rows"):
+        return
+    saved = report["predict_sec"] / max(report["unique_rows"], 1) * (report["rows"] - report["unique_rows"]) \
+        - report["dedup_sec"]
+    logs.send(f"Deduplication: {report['rows']} rows, {report['unique_rows']} unique rows, "
+              f"unique ratio {report['unique_rows'] / report['rows']:.4f}. "
+              f"Dedup time: {report['dedup_sec']:.3f} sec, prediction time: {report['predict_sec']:.3f} sec, "
+              f"estimated time saved: {saved:.3f} sec.",
+              is_error=False)
+
+
+def predict_rows(model,
+                 X: pd.DataFrame,
+                 dedup_report: dict = None,
+                 cache: PredictionCache = None) -> np.ndarray:
+    """Function to run prediction through the optional cache and deduplication stages
+
+    Args:
+        model: model object
+        X: pd.DataFrame with features values
+        dedup_report: dict to accumulate the deduplication counters into, see predict_unique;
+                      all rows are scored if None
+        cache: predictions cache, the rows missing in the cache are scored by the model
+
+    Returns:
+        predictions vector
+
+    Raises:
+        prediction error
+    """
+    predict = model.predict if dedup_report is None else partial(predict_unique, model, report=dedup_report)
+    if cache is None:
+        return predict(X)
+    return cache.predict(X, predict)
+
+
+def save_cache(cache: PredictionCache,
+               logs: getLogger):
+    """Function to store the predictions cache and log its metrics
+
+    Args:
+        cache: predictions cache
+        logs: logger object
+    """
+    try:
+        cache.save()
+    except Exception as ex:
+        logs.send(f"Cannot save the predictions cache into {cache.path}. Error:\n{ex}",
+                  lineno=logs.get_line())
+    logs.send(f"Predictions cache: {cache.report()}",
+              is_error=False)
+
+
+def delta_keys(df: pd.DataFrame,
+               X: pd.DataFrame) -> np.ndarray:
+    """Function to hash the input rows by the entity_id and the features values
+
+    Args:
+        df: input dataframe
+        X: pd.DataFrame with features values
+
+    Returns:
+        uint64 array with the rows hashes
+    """
+    return hash_rows(X.assign(entity_id=df["entity_id"].to_numpy()))
+
+
+def load_previous(path_data_in: str,
+                  path_data_out: str,
+                  model_digest: str,
+                  data_preparation) -> Tuple[np.ndarray, np.ndarray]:
+    """Function to load the previous day's predictions by the input rows hashes
+
+    The previous output is aligned with the previous input row by row,
+    its predictions are read as text to be carried forward without rounding.
+
+    Args:
+        path_data_in: path to the previous input
+        path_data_out: path to the previous output
+        model_digest: digest of the model artifact, see prediction_cache.artifact_digest
+        data_preparation: function to align data with the model requirements
+
+    Returns:
+        tuple with the sorted unique rows hashes and their predictions
+
+    Raises:
+        IOError, or ValueError, the previous partition cannot be used
+    """
+    path_meta = f"{path_data_out}{DELTA_META_SUFFIX}"
+    if not os.path.isfile(path_meta):
+        raise IOError(f"{path_meta} not found, the previous output was not scored in the delta mode")
+    with open(path_meta) as f:
+        meta = json.load(f)
+    if meta["model_digest"] != model_digest:
+        raise ValueError(f"{path_data_out} was scored by another model artifact {meta['model']}")
+
+    df, err = load_data(path_data_in, schema=DATA_SCHEMA, data_format=DATA_FORMAT)
+    if err:
+        raise IOError(f"Cannot read {path_data_in}. {err}")
+    if SERVE_FANOUT:
+        df = fan_out(df)
+    X, _, err = data_preparation(df, target_col=None)
+    if err:
+        raise ValueError(f"{path_data_in} is not aligned with the model requirements. {err}")
+    df_out, err = load_data(path_data_out,
+                            schema={"entity_id": "int64", "device": "category", "cr": "object"},
+                            data_format=DATA_FORMAT)
+    if err:
+        raise IOError(f"Cannot read {path_data_out}. {err}")
+    if len(df_out) != len(df) or not np.array_equal(df_out["entity_id"].to_numpy(), df["entity_id"].to_numpy()):
+        raise ValueError(f"{path_data_out} is not aligned with {path_data_in}")
+
+    y_pred = df_out["cr"].to_numpy(dtype=object).astype(np.float64).astype(meta["dtype"])
+    keys, index = np.unique(delta_keys(df, X), return_index=True)
+    return keys, y_pred[index]
+
+
+def predict_delta(model,
+                  df: pd.DataFrame,
+                  X: pd.DataFrame,
+                  previous: Tuple[np.ndarray, np.ndarray],
+                  dedup_report: dict = None,
+                  cache: PredictionCache = None) -> Tuple[np.ndarray, int]:
+    """Function to score the rows new, or changed since the previous input and carry forward the other rows predictions
+
+    Args:
+        model: model object
+        df: input dataframe
+        X: pd.DataFrame with features values
+        previous: previous rows hashes and predictions, see load_previous
+        dedup_report: dict to accumulate the deduplication counters into, see predict_rows
+        cache: predictions cache, see predict_rows
+
+    Returns:
+        tuple with the predictions vector and the number of scored rows
+
+    Raises:
+        prediction error
+    """
+    keys, y_prev = previous
+    position, found = find_keys(delta_keys(df, X), keys)
+    changed = ~found
+    rescored = int(changed.sum())
+    if not rescored:
+        return y_prev[position], rescored
+    y_changed = predict_rows(model, X.iloc[changed], dedup_report, cache)
+    y_pred = np.empty(len(X), dtype=y_changed.dtype)
+    y_pred[found] = y_prev[position[found]]
+    y_pred[changed] = y_changed
+    return y_pred, rescored
+
+
+def predict_sla(model,
+                data_preparation,
+                df: pd.DataFrame,
+                dedup_report: dict = None,
+                cache: PredictionCache = None,
+                fanout: bool = False) -> pd.DataFrame:
+    """Function to run prediction and align its output with SLA
+
+    Args:
+        model: model object
+        data_preparation: function to align data with the model requirements
+        df: input dataframe
+        dedup_report: dict to accumulate the deduplication counters into, see predict_unique;
+                      all rows are scored if None
+        cache: predictions cache, see predict_rows
+        fanout: flag to score every entity row for all devices, see fan_out
+
+    Returns:
+        pd.DataFrame
+
+    Raises:
+        data preparation, or prediction error
+    """
+    if fanout:
+        df = fan_out(df)
+    X, _, err = data_preparation(df, target_col=None)
+    if err:
+        raise err
+    return data_output_sla(df, predict_rows(model, X, dedup_report, cache))
+
+
+def init_worker(model_version: str,
+                path_model: str,
+                threads: int = None):
+    """Function to load the model once per worker process
+
+    Args:
+        model_version: model version
+        path_model: path to the model
+        threads: number of threads of the worker
+    """
+    global worker_definition, worker_model
+    set_threads(threads)
+    worker_definition = importlib.import_module(f"{MODEL_PKG_NAME}.{model_version}.model")
+    worker_model = worker_definition.Model()
+    worker_model.load(path_model)
+    worker_model.set_threads(nthread=threads)
+
+
+def predict_shard(path: str,
+                  start: int,
+                  rows: int) -> Tuple[pd.DataFrame, dict]:
+    """Function to score a range of rows of the input data set in the worker process
+
+    Args:
+        path: path to the input data
+        start: index of the first row of the shard
+        rows: number of rows in the shard
+
+    Returns:
+        tuple with the prediction aligned with SLA and the shard timings
+
+    Raises:
+        data read, data preparation, or prediction error
+    """
+    t0 = time.time()
+    df, err = load_data_range(path, start, rows, schema=DATA_SCHEMA, data_format=DATA_FORMAT)
+    if err:
+        raise err
+    t_read = time.time() - t0
+    dedup_report = {} if SERVE_DEDUP else None
+    result = predict_sla(worker_model, worker_definition.data_preparation, df, dedup_report,
+                         fanout=SERVE_FANOUT)
+    timing = {"start": start,
+              "rows": len(df),
+              "pid": os.getpid(),
+              "read": round(t_read, 2),
+              "total": round(time.time() - t0, 2),
+              "dedup": dedup_report}
+    return result, timing
+
+
+def log_shards(shards: Iterable[Tuple[pd.DataFrame, dict]],
+               logs: getLogger,
+               dedup_report: dict = None) -> Iterator[pd.DataFrame]:
+    """Function to log the shards timings while passing the shards results through
+
+    Args:
+        shards: iterable with prediction results and timings of the shards
+        logs: logger object
+        dedup_report: dict to accumulate the shards deduplication counters into
+
+    Returns:
+        iterator over prediction results of the shards
+    """
+    for i, (result, timing) in enumerate(shards):
+        logs.send(f"Shard {i}: rows {timing['start']}-{timing['start'] + timing['rows']} "
+                  f"scored by worker {timing['pid']}. Read time: {timing['read']} sec, "
+                  f"total time: {timing['total']} sec.",
+                  is_error=False)
+        if dedup_report is not None and timing["dedup"]:
+            for k, v in timing["dedup"].items():
+                dedup_report[k] = dedup_report.get(k, 0) + v
+        yield result
+
 
 if __name__ == "__main__":
     logs = getLogger(logger=f"service/serve/{MODEL_VERSION}",
                      webhook_url=WEBHOOK_URL)
 
+    # limit the threads pools to the CPUs available to the container
+    try:
+        threads = set_threads()
+    except ValueError as ex:
+        logs.send(f"Cannot define the threading configuration. Error:\n{ex}",
+                  lineno=logs.get_line(),
+                  kill=True)
+    # the CPUs are split between the worker processes
+    worker_threads = max(threads["threads"] // SERVE_WORKERS, 1)
+    logs.send(f"Threading configuration: {threads}. Threads per worker: {worker_threads}.",
+              is_error=False)
+
     # link the model module
     try:
         model_definition = importlib.import_module(f"{MODEL_PKG_NAME}.{MODEL_VERSION}.model")
@@ -92,31 +514,169 @@ if __name__ == "__main__":
     model = model_definition.Model()
     try:
         model.load(path_model)
+        model.set_threads(nthread=threads["threads"])
     except Exception as ex:
         logs.send(f"Cannot load model from {path_model}. Error:\n{ex}",
                   lineno=logs.get_line(),
                   kill=True)
 
+    path_data_out = os.path.join(BUCKET_DATA, PATH_DATA_OUT)
+    if not os.path.isdir(os.path.dirname(path_data_out)):
+        os.makedirs(os.path.dirname(path_data_out))
+    # the metadata of the output scored previously is written again in the delta mode only
+    if os.path.isfile(f"{path_data_out}{DELTA_META_SUFFIX}"):
+        os.remove(f"{path_data_out}{DELTA_META_SUFFIX}")
+
+    dedup_report = {} if SERVE_DEDUP else None
+
+    if SERVE_DELTA and (SERVE_WORKERS > 1 or SERVE_CHUNK_ROWS > 0):
+        logs.send("Delta scoring reads the whole input at once, SERVE_WORKERS and SERVE_CHUNK_ROWS are ignored",
+                  lineno=logs.get_line())
+
+    cache = None
+    if PREDICTION_CACHE and SERVE_WORKERS > 1 and not SERVE_DELTA:
+        logs.send("Predictions cache is not supported by the parallel workers, all rows are scored",
+                  lineno=logs.get_line())
+    elif PREDICTION_CACHE:
+        try:
+            cache = PredictionCache(path_model, PREDICTION_CACHE_DIR, max_rows=PREDICTION_CACHE_ROWS)
+        except Exception as ex:
+            logs.send(f"Cannot open the predictions cache in {PREDICTION_CACHE_DIR}, all rows are scored. "
+                      f"Error:\n{ex}",
+                      lineno=logs.get_line())
+
+    # score row ranges of the data set in parallel worker processes
+    if SERVE_WORKERS > 1 and not SERVE_DELTA:
+        total_rows, err = count_rows(path_data_in, data_format=DATA_FORMAT)
+        if err:
+            logs.send(f"Cannot read data from {path_data_in}. Error:\n{err}",
+                      lineno=logs.get_line(),
+                      kill=True)
+        shard_rows = max(-(-total_rows // SERVE_WORKERS), 1)
+        shard_starts = range(0, total_rows, shard_rows)
+
+        t0 = time.time()
+        try:
+            with ProcessPoolExecutor(max_workers=SERVE_WORKERS,
+                                     initializer=init_worker,
+                                     initargs=(MODEL_VERSION, path_model, worker_threads)) as executor:
+                shards = executor.map(predict_shard,
+                                      repeat(path_data_in),
+                                      shard_starts,
+                                      repeat(shard_rows))
+                rows = save_data_chunks(log_shards(shards, logs, dedup_report),
+                                        path=path_data_out,
+                                        data_format=DATA_FORMAT,
+                                        empty=empty_output(model, model_definition.data_preparation, path_data_in))
+        except Exception as ex:
+            if os.path.isfile(path_data_out):
+                os.remove(path_data_out)
+            logs.send(f"Parallel prediction into {path_data_out} failed. Error:\n{ex}",
+                      lineno=logs.get_line(),
+                      kill=True)
+
+        if dedup_report is not None:
+            log_dedup(dedup_report, logs)
+        t = round(time.time() - t0, 2)
+        logs.send(f"Serve service successfully completed. Scored {rows} rows in {len(shard_starts)} shards "
+                  f"by {SERVE_WORKERS} workers. Total Elapsed time: {t} sec.",
+                  is_error=False,
+                  webhook=True,
+                  kill=True)
+
+    # stream the data set through the model chunk by chunk
+    if SERVE_CHUNK_ROWS > 0 and not SERVE_DELTA:
+        chunks, err = load_data_chunks(path_data_in, SERVE_CHUNK_ROWS,
+                                       schema=DATA_SCHEMA, data_format=DATA_FORMAT)
+        if err:
+            logs.send(f"Cannot read data from {path_data_in}. Error:\n{err}",
+                      lineno=logs.get_line(),
+                      kill=True)
+
+        t0 = time.time()
+        try:
+            rows = save_data_chunks((predict_sla(model, model_definition.data_preparation, df, dedup_report, cache,
+                                                 fanout=SERVE_FANOUT)
+                                     for df in chunks),
+                                    path=path_data_out,
+                                    data_format=DATA_FORMAT,
+                                    empty=empty_output(model, model_definition.data_preparation, path_data_in))
+        except Exception as ex:
+            if os.path.isfile(path_data_out):
+                os.remove(path_data_out)
+            logs.send(f"Chunked prediction into {path_data_out} failed. Error:\n{ex}",
+                      lineno=logs.get_line(),
+                      kill=True)
+
+        if dedup_report is not None:
+            log_dedup(dedup_report, logs)
+        if getattr(model, "table", None) is not None:
+            logs.send(f"Predictions lookup table: {model.table.report()}",
+                      is_error=False)
+        if cache is not None:
+            save_cache(cache, logs)
+        t = round(time.time() - t0, 2)
+        logs.send(f"Serve service successfully completed. Scored {rows} rows in chunks of {SERVE_CHUNK_ROWS}. "
+                  f"Total Elapsed time: {t} sec.",
+                  is_error=False,
+                  webhook=True,
+                  kill=True)
+
     # load data set to feed into the model
-    df, err = load_data(path_data_in)
+    df, err = load_data(path_data_in, schema=DATA_SCHEMA, data_format=DATA_FORMAT)
     if err:
         logs.send(f"Cannot read data from {path_data_in}. Error:\n{err}",
                   lineno=logs.get_line(),
                   kill=True)
 
+    if SERVE_FANOUT:
+        try:
+            df = fan_out(df)
+        except ValueError as ex:
+            logs.send(f"Input data structure is not aligned with the fan-out mode. Error:\n{ex}",
+                      lineno=logs.get_line(),
+                      kill=True)
+
     X, y, err = model_definition.data_preparation(df, target_col=None)
     if err:
         logs.send(f"Input data structure is not aligned with the model requirements. Error:\n{err}",
                   lineno=logs.get_line(),
                   kill=True)
 
+    # load the previous day's predictions to carry forward
+    previous = None
+    if SERVE_DELTA:
+        model_digest = cache.digest if cache is not None else artifact_digest(os.path.realpath(path_model))
+        t0 = time.time()
+        try:
+            previous = load_previous(os.path.join(BUCKET_DATA, PATH_DATA_IN_PREV),
+                                     os.path.join(BUCKET_DATA, PATH_DATA_OUT_PREV),
+                                     model_digest,
+                                     model_definition.data_preparation)
+        except Exception as ex:
+            logs.send(f"Previous day's predictions cannot be carried forward, all rows are scored. Error:\n{ex}",
+                      lineno=logs.get_line())
+        t_previous = round(time.time() - t0, 2)
+
     # run prediction
     t0 = time.time()
     try:
-        prediction_results = model.predict(X)
+        if previous is not None:
+            prediction_results, rescored = predict_delta(model, df, X, previous, dedup_report, cache)
+            logs.send(f"Delta scoring: rescored {rescored} new, or changed rows of {len(X)} rows, "
+                      f"carried forward {len(X) - rescored} predictions from {PATH_DATA_OUT_PREV} "
+                      f"loaded in {t_previous} sec.",
+                      is_error=False)
+        else:
+            prediction_results = predict_rows(model, X, dedup_report, cache)
         t = round(time.time() - t0, 2)
         logs.send(f"Prediction completed. Elapsed time: {t} sec. Saving results.", 
                   is_error=False)
+        if dedup_report is not None:
+            log_dedup(dedup_report, logs)
+        if getattr(model, "table", None) is not None:
+            logs.send(f"Predictions lookup table: {model.table.report()}",
+                      is_error=False)
     except Exception as ex:
         logs.send(f"Prediction error.\n{ex}",
                   lineno=logs.get_line(),
@@ -124,21 +684,30 @@ if __name__ == "__main__":
 
     # convert results to comply with the output SLA
     try:
-        df_prediction_results = data_output_sla(df.copy(), prediction_results)
+        df_prediction_results = data_output_sla(df, prediction_results)
     except Exception as ex:
         logs.send(f"Cannot convert prediction according to output SLA. Error:\n{ex}",
                   lineno=logs.get_line(),
                   kill=True)
 
-    path_data_out = os.path.join(BUCKET_DATA, PATH_DATA_OUT)
-    if not os.path.isdir(os.path.dirname(path_data_out)):
-        os.makedirs(os.path.dirname(path_data_out))
     try:
-        save_data(df_prediction_results, path=path_data_out)
+        save_data(df_prediction_results, path=path_data_out, data_format=DATA_FORMAT)
     except Exception as ex:
         logs.send(f"Cannot save prediction into {path_data_out}. Error:\n{ex}",
                   lineno=logs.get_line(),
                   kill=True)
+    if SERVE_DELTA:
+        try:
+            with open(f"{path_data_out}{DELTA_META_SUFFIX}", 'w') as f:
+                json.dump({"model": path_model,
+                           "model_digest": model_digest,
+                           "dtype": str(prediction_results.dtype),
+                           "rows": len(prediction_results)}, f)
+        except Exception as ex:
+            logs.send(f"Cannot save the output metadata, the output cannot be carried forward. Error:\n{ex}",
+                      lineno=logs.get_line())
+    if cache is not None:
+        save_cache(cache, logs)
         
     t = round(time.time() - t0, 2)
     logs.send(f"Serve service successfully completed. Total Elapsed time: {t} sec.", 
@@ -0,0 +1,305 @@
+# Dmitry Kisler © 2019
+# www.dkisler.com
+
+import os
+import re
+import time
+import asyncio
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import numpy as np
+from aiohttp import web
+from service_pkg.logger import getLogger
+from service_pkg.file_io import SCHEMAS
+from service_pkg.threads import get_threads, set_threads
+from runner import MODEL_PKG_NAME, MODEL_VERSION, BUCKET_MODEL, PATH_MODEL, WEBHOOK_URL, predict_sla
+from batching import MicroBatcher
+from model_cache import ModelCache
+import warnings
+warnings.simplefilter(action='ignore',
+                      category=FutureWarning)
+
+
+SERVE_PORT = int(os.getenv("SERVE_PORT", 8080))
+# number of threads to run prediction off the event loop
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", 1))
+# number of the latest requests to calculate latency percentiles over
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", 10000))
+# max number of rows to group concurrent requests into a single prediction batch
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", 256))
+# max time to wait for the prediction batch to fill up
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 2))
+# memory budget of the loaded models cache, estimated as the models artifacts size
+MODEL_CACHE_MB = float(os.getenv("MODEL_CACHE_MB", 1024))
+
+# features_v1 input columns in the order the models were trained with
+COLS_INPUT = [i for i in SCHEMAS["features_v1"] if i != "cr"]
+
+
+class LatencyTracker:
+    """Rolling window of request latencies"""
+
+    def __init__(self,
+                 window=LATENCY_WINDOW):
+        """Instantiate tracker
+
+            Args:
+                window: number of the latest requests to keep
+        """
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+    def add(self,
+            latency: float,
+            is_error=False):
+        """Function to record request latency
+
+            Args:
+                latency: request latency in sec
+                is_error: flag to signal if request failed
+        """
+        self.requests += 1
+        self.errors += int(is_error)
+        self.latencies.append(latency)
+
+    def report(self) -> dict:
+        """Function to report latency percentiles
+
+            Returns:
+                dict with requests counters and p50/p95/p99 latencies in ms
+        """
+        report = {"requests": self.requests,
+                  "errors": self.errors}
+        if self.latencies:
+            p50, p95, p99 = np.percentile(self.latencies, [50, 95, 99]) * 1000
+            report.update({"p50_ms": round(float(p50), 3),
+                           "p95_ms": round(float(p95), 3),
+                           "p99_ms": round(float(p99), 3)})
+        return report
+
+
+def predict_cached(cache: ModelCache,
+                   version: str,
+                   path: str,
+                   df: pd.DataFrame) -> pd.DataFrame:
+    """Function to run prediction with the model from the cache
+
+       Args:
+          cache: models cache
+          version: model version
+          path: path to the model
+          df: input rows
+
+       Returns:
+          prediction rows aligned with SLA
+    """
+    model_definition, model = cache.get(version, path)
+    return predict_sla(model, model_definition.data_preparation, df)
+
+
+async def get_batcher(app: web.Application,
+                      version: str,
+                      path: str) -> MicroBatcher:
+    """Function to get the batching scheduler of the model
+
+       The model is loaded before its scheduler is created, hence the schedulers are kept
+       for the valid models only. The idle schedulers of the models evicted from the cache are stopped,
+       the new scheduler of the model carries on the metrics of its stopped scheduler.
+
+       Args:
+          app: web application object
+          version: model version
+          path: path to the model
+
+       Returns:
+          batching scheduler object
+
+       Raises:
+          model import, or load error
+    """
+    key = (version, path)
+    if key not in app["batchers"]:
+        await asyncio.get_running_loop().run_in_executor(app["executor"], app["cache"].get, version, path)
+    if key not in app["batchers"]:
+        batcher = MicroBatcher(partial(predict_cached, app["cache"], version, path),
+                               executor=app["executor"],
+                               max_rows=BATCH_MAX_ROWS,
+                               max_wait_ms=BATCH_MAX_WAIT_MS,
+                               max_batches=SERVE_THREADS)
+        if key in app["batchers_stopped"]:
+            batcher.absorb(app["batchers_stopped"].pop(key))
+        app["batchers"][key] = batcher
+        await batcher.start()
+        await evict_batchers(app)
+    return app["batchers"][key]
+
+
+async def evict_batchers(app: web.Application):
+    """Function to stop the idle batching schedulers of the models evicted from the cache
+
+       The stopped schedulers are kept to report their metrics.
+
+       Args:
+          app: web application object
+    """
+    loaded = app["cache"].loaded()
+    for key in [k for k, batcher in app["batchers"].items() if k not in loaded and batcher.pending == 0]:
+        batcher = app["batchers"].pop(key)
+        app["batchers_stopped"][key] = batcher
+        await batcher.stop()
+
+
+async def predict(request: web.Request) -> web.Response:
+    """Handler to score JSON rows in features_v1 schema
+
+       The model is defined by the query parameters "version" and "model" (path in the model bucket),
+       the service model MODEL_VERSION from PATH_MODEL is used by default.
+
+       Args:
+          request: request with the list of input rows as JSON body
+
+       Returns:
+          response with the list of prediction rows aligned with SLA
+    """
+    app = request.app
+    t0 = time.perf_counter()
+
+    version = request.query.get("version", MODEL_VERSION)
+    path = os.path.realpath(os.path.join(BUCKET_MODEL, request.query.get("model", PATH_MODEL)))
+    if re.fullmatch(r"v\d+", version) is None \
+            or not path.startswith(os.path.realpath(BUCKET_MODEL) + os.sep) \
+            or not os.path.exists(path):
+        app["latency"].add(time.perf_counter() - t0, is_error=True)
+        return web.json_response({"error": f"Model {version} {request.query.get('model', PATH_MODEL)} not found"},
+                                 status=404)
+
+    try:
+        rows = await request.json()
+        if isinstance(rows, dict):
+            rows = [rows]
+        # non-numeric values are coerced to NaN to reject the request before it joins the batch
+        df = pd.DataFrame(rows, columns=COLS_INPUT).apply(pd.to_numeric, errors="coerce")
+        if df.isnull().values.any():
+            raise ValueError(f"Input rows must contain the numeric columns: {', '.join(COLS_INPUT)}")
+    except Exception as ex:
+        app["latency"].add(time.perf_counter() - t0, is_error=True)
+        return web.json_response({"error": f"Invalid input. Error: {ex}"}, status=400)
+
+    try:
+        batcher = await get_batcher(app, version, path)
+    except Exception as ex:
+        app["latency"].add(time.perf_counter() - t0, is_error=True)
+        app["logs"].send(f"Cannot load model {version} from {path}. Error:\n{ex}",
+                         lineno=app["logs"].get_line())
+        return web.json_response({"error": f"Cannot load model {version} {request.query.get('model', PATH_MODEL)}. "
+                                           f"Error: {ex}"},
+                                 status=500)
+
+    try:
+        result = await batcher.submit(df)
+    except Exception as ex:
+        app["latency"].add(time.perf_counter() - t0, is_error=True)
+        app["logs"].send(f"Prediction error.\n{ex}",
+                         lineno=app["logs"].get_line())
+        return web.json_response({"error": f"Prediction error. Error: {ex}"}, status=500)
+
+    app["latency"].add(time.perf_counter() - t0)
+    return web.Response(text=result.to_json(orient="records",
+                                            double_precision=15),
+                        content_type="application/json")
+
+
+async def metrics(request: web.Request) -> web.Response:
+    """Handler to report the service latency, batching and models cache metrics"""
+    app = request.app
+    return web.json_response({**app["latency"].report(),
+                              "batching": {f"{version}:{path}": batcher.report()
+                                           for (version, path), batcher in {**app["batchers_stopped"],
+                                                                            **app["batchers"]}.items()},
+                              "cache": app["cache"].report()})
+
+
+async def health(request: web.Request) -> web.Response:
+    """Handler to report the service status"""
+    return web.json_response({"status": "ok",
+                              "model": MODEL_VERSION})
+
+
+async def shutdown(app: web.Application):
+    """Function to release resources on the server shutdown"""
+    for batcher in app["batchers"].values():
+        await batcher.stop()
+    app["logs"].send(f"Serve server stopped. Latency: {app['latency'].report()}. "
+                     f"Models cache: {app['cache'].report()}",
+                     is_error=False)
+    app["executor"].shutdown(wait=True)
+
+
+def get_app(cache: ModelCache,
+            logs: getLogger) -> web.Application:
+    """Function to define the web application
+
+       Args:
+          cache: models cache
+          logs: logger object
+
+       Returns:
+          web application object
+    """
+    app = web.Application()
+    app["cache"] = cache
+    app["logs"] = logs
+    app["executor"] = ThreadPoolExecutor(max_workers=SERVE_THREADS)
+    app["batchers"] = {}
+    # schedulers of the models evicted from the cache
+    app["batchers_stopped"] = {}
+    app["latency"] = LatencyTracker()
+    app.router.add_post("/predict", predict)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/health", health)
+    app.on_shutdown.append(shutdown)
+    return app
+
+
+if __name__ == "__main__":
+    logs = getLogger(logger=f"service/serve-server/{MODEL_VERSION}",
+                     webhook_url=WEBHOOK_URL)
+
+    path_model = os.path.join(BUCKET_MODEL, PATH_MODEL)
+    if not os.path.isfile(path_model):
+        logs.send(f"Model {path_model} not found",
+                  lineno=logs.get_line(),
+                  kill=True)
+
+    # the CPUs available to the container are split between the prediction threads
+    try:
+        cpus, source = get_threads()
+        threads = set_threads(max(cpus // SERVE_THREADS, 1))
+    except ValueError as ex:
+        logs.send(f"Cannot define the threading configuration. Error:\n{ex}",
+                  lineno=logs.get_line(),
+                  kill=True)
+    logs.send(f"Threading configuration: {cpus} CPUs ({source}) split between {SERVE_THREADS} "
+              f"prediction threads, per thread: {threads}",
+              is_error=False)
+
+    # load the service model into the cache on start to fail fast
+    cache = ModelCache(package=MODEL_PKG_NAME,
+                       max_mb=MODEL_CACHE_MB,
+                       nthread=threads["threads"])
+    try:
+        cache.get(MODEL_VERSION, path_model)
+    except Exception as ex:
+        logs.send(f"Cannot load model {MODEL_VERSION} from {path_model}. Error:\n{ex}",
+                  lineno=logs.get_line(),
+                  kill=True)
+
+    logs.send(f"Serve server started on port {SERVE_PORT}.",
+              is_error=False,
+              webhook=True)
+    web.run_app(get_app(cache, logs),
+                port=SERVE_PORT,
+                print=None)
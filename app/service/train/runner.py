@@ -3,11 +3,13 @@
 
 import os
 import time
+import inspect
 from typing import Tuple
 import pandas as pd
 import numpy as np
 from service_pkg.logger import getLogger
-from service_pkg.file_io import load_data, save_data
+from service_pkg.file_io import load_data, save_data, load_data_chunks
+from service_pkg.threads import set_threads
 import importlib
 import warnings
 warnings.simplefilter(action='ignore', 
@@ -35,10 +37,56 @@ PATH_DATA_EVAL = os.getenv("PATH_DATA_EVAL",
                            os.path.join(time.strftime('%Y/%m/%d'),
                                         "eval.csv.gz"))
 
+# data schema name to load the data with compact dtypes, see service_pkg.file_io.SCHEMAS
+DATA_SCHEMA = os.getenv("DATA_SCHEMA") or None
+# data format of the train and eval files: csv, parquet, feather; defined by the files extensions by default
+DATA_FORMAT = os.getenv("DATA_FORMAT") or None
+
+# collapse the identical features rows into the unique rows weighted by the number of identical rows before fit
+TRAIN_DEDUP = os.getenv("TRAIN_DEDUP") == "1"
+# column with the rows weights, e.g. clicks, the rows are equally weighted if not set
+TRAIN_WEIGHT_COL = os.getenv("TRAIN_WEIGHT_COL") or None
+
+# number of rows per chunk to stream the train data set through the model, v1 model only;
+# the data set is read at once if 0
+TRAIN_CHUNK_ROWS = int(os.getenv("TRAIN_CHUNK_ROWS", 0))
+
+# number of rounds without the score improvement on the rows held out of the train data set
+# to stop the training of the xgboost models; early stopping is disabled if 0
+EARLY_STOPPING_ROUNDS = int(os.getenv("EARLY_STOPPING_ROUNDS", 0))
+# fraction of the train data set rows held out to stop the training early
+EARLY_STOPPING_HOLDOUT = float(os.getenv("EARLY_STOPPING_HOLDOUT", 0.2))
+
+# path to the previous model in the model bucket to continue training from,
+# the xgboost models continue boosting, the v1 model is updated with the new data;
+# the model is trained from scratch if not set
+WARM_START_FROM = os.getenv("WARM_START_FROM") or None
+# warm start options, the model defaults are used if not set
+WARM_START_OPTIONS = {k: v for k, v in {
+    "n_estimators": int(os.getenv("WARM_START_TREES", 0)),
+    "max_trees": int(os.getenv("WARM_START_MAX_TREES", 0)),
+    "prune": os.getenv("WARM_START_PRUNE") == "1"
+}.items() if v}
+# train the model from scratch as well to compare the warm started model with the full retrain
+WARM_START_COMPARE = os.getenv("WARM_START_COMPARE") == "1"
+
+# store the predictions lookup table over the distinct features vectors of the train and eval data sets
+# with the model, the features vectors found in the table are not scored by the model at serving time
+TRAIN_TABULATE = os.getenv("TRAIN_TABULATE") == "1"
+
 
 if __name__ == "__main__":
     logs = getLogger(logger=f"service/train/{MODEL_VERSION}",
                      webhook_url=WEBHOOK_URL)
+
+    # limit the threads pools to the CPUs available to the container
+    try:
+        threads = set_threads()
+    except ValueError as ex:
+        logs.send(f"Cannot define the threading configuration. Error:\n{ex}",
+                  lineno=logs.get_line(),
+                  kill=True)
+    logs.send(f"Threading configuration: {threads}", is_error=False)
     
     # link the model module
     try:
@@ -47,6 +95,13 @@ if __name__ == "__main__":
         logs.send(f"Model {MODEL_VERSION} is not defined in the package {MODEL_PKG_NAME}.\nError:{ex}",
                   lineno=logs.get_line(),
                   kill=True)
+    if EARLY_STOPPING_ROUNDS > 0 and \
+            (TRAIN_CHUNK_ROWS > 0
+             or "early_stopping_rounds" not in inspect.signature(model_definition.Model.train).parameters):
+        logs.send(f"Early stopping is not supported by the model {MODEL_VERSION}"
+                  f"{' trained chunk by chunk' if TRAIN_CHUNK_ROWS > 0 else ''}",
+                  lineno=logs.get_line(),
+                  kill=True)
 
     path_data_train = os.path.join(BUCKET_DATA, PATH_DATA_TRAIN)
     if not os.path.isfile(path_data_train):
@@ -55,51 +110,178 @@ if __name__ == "__main__":
                   kill=True)
     # if no eval data set proveded, use only train data set
     path_data_eval = os.path.join(BUCKET_DATA, PATH_DATA_EVAL)
-    if not os.path.isfile(path_data_train):
+    if not os.path.isfile(path_data_eval):
         path_data_eval = None
 
-    # load data set to train the model
-    df, err = load_data(path_data_train)
-    if err:
-        logs.send(f"Cannot read train data from {path_data_train}. Error:\n{err}",
-                  lineno=logs.get_line(),
-                  kill=True)
+    # load data set to train the model, the chunks are read while training
+    if TRAIN_CHUNK_ROWS > 0:
+        if not hasattr(model_definition.Model, "partial_fit"):
+            logs.send(f"Training chunk by chunk is not supported by the model {MODEL_VERSION}",
+                      lineno=logs.get_line(),
+                      kill=True)
+        chunks, err = load_data_chunks(path_data_train, TRAIN_CHUNK_ROWS,
+                                       schema=DATA_SCHEMA, data_format=DATA_FORMAT)
+        if err:
+            logs.send(f"Cannot read train data from {path_data_train}. Error:\n{err}",
+                      lineno=logs.get_line(),
+                      kill=True)
+    else:
+        df, err = load_data(path_data_train, schema=DATA_SCHEMA, data_format=DATA_FORMAT)
+        if err:
+            logs.send(f"Cannot read train data from {path_data_train}. Error:\n{err}",
+                      lineno=logs.get_line(),
+                      kill=True)
 
-    X, y, err = model_definition.data_preparation(df)
-    if err:
-        logs.send(f"Train data structure is not aligned with the model requirements. Error:\n{err}",
-                  lineno=logs.get_line(),
-                  kill=True)
+        sample_weight = None
+        if TRAIN_WEIGHT_COL is not None:
+            if TRAIN_WEIGHT_COL not in df.columns:
+                logs.send(f"Weight column {TRAIN_WEIGHT_COL} not found in {path_data_train}",
+                          lineno=logs.get_line(),
+                          kill=True)
+            sample_weight = df.pop(TRAIN_WEIGHT_COL).to_numpy()
+
+        X, y, err = model_definition.data_preparation(df)
+        if err:
+            logs.send(f"Train data structure is not aligned with the model requirements. Error:\n{err}",
+                      lineno=logs.get_line(),
+                      kill=True)
+        X_tabulate = X
+
+        # hold out the train rows to stop the training early, the eval data set stays unseen by the training
+        stopping = {}
+        if EARLY_STOPPING_ROUNDS > 0:
+            holdout = np.random.rand(len(X)) < EARLY_STOPPING_HOLDOUT
+            if holdout.all() or not holdout.any():
+                logs.send(f"Cannot hold out {EARLY_STOPPING_HOLDOUT} of {len(X)} train rows to stop the training early",
+                          lineno=logs.get_line(),
+                          kill=True)
+            stopping = {"eval_set": (X[holdout], y[holdout]),
+                        "early_stopping_rounds": EARLY_STOPPING_ROUNDS}
+            X, y = X[~holdout], y[~holdout]
+            if sample_weight is not None:
+                sample_weight = sample_weight[~holdout]
+            logs.send(f"Early stopping after {EARLY_STOPPING_ROUNDS} rounds without improvement "
+                      f"on {int(holdout.sum())} train rows held out",
+                      is_error=False)
+
+    # load data set to evaluate the model
+    eval_set = None
+    if path_data_eval is not None:
+        df_eval, err = load_data(path_data_eval, schema=DATA_SCHEMA, data_format=DATA_FORMAT)
+        if err:
+            logs.send(f"Cannot read eval data from {path_data_eval}."
+                      f"Evaluation to be done using train data set. Error:\n{err}",
+                      lineno=logs.get_line(),
+                      kill=False)
+        else:
+            if TRAIN_WEIGHT_COL is not None and TRAIN_WEIGHT_COL in df_eval.columns:
+                df_eval = df_eval.drop(TRAIN_WEIGHT_COL, axis=1)
+            X_eval, y_eval, err = model_definition.data_preparation(df_eval)
+            if err:
+                logs.send(f"Eval data set cannot be processed. Error:\n{err}",
+                          lineno=logs.get_line())
+            else:
+                eval_set = (X_eval, y_eval)
     
     # initilize model
-    model = model_definition.Model()
+    model = model_definition.Model(dedup=TRAIN_DEDUP)
+    model.set_threads(nthread=threads["threads"], n_jobs=threads["threads"])
     
     # train the model
-    logs.send("Start model training", is_error=False)
     t0 = time.time()
-    train_metrics = model.train(X, y)
+    path_warm_start = None if WARM_START_FROM is None else os.path.join(BUCKET_MODEL, WARM_START_FROM)
+    if path_warm_start is not None and not hasattr(model, "warm_start"):
+        logs.send(f"Warm start is not supported by the model {MODEL_VERSION}",
+                  lineno=logs.get_line(),
+                  kill=True)
+    if TRAIN_CHUNK_ROWS > 0:
+        logs.send(f"Start model training chunk by chunk of {TRAIN_CHUNK_ROWS} rows"
+                  f"{'' if path_warm_start is None else ' from ' + path_warm_start}",
+                  is_error=False)
+        # the model accumulates the chunks statistics, hence the memory doesn't depend on the number of rows
+        try:
+            if path_warm_start is not None:
+                model.load(path_warm_start)
+            train_metrics = None
+            for df in chunks:
+                sample_weight = None
+                if TRAIN_WEIGHT_COL is not None:
+                    if TRAIN_WEIGHT_COL not in df.columns:
+                        raise ValueError(f"Weight column {TRAIN_WEIGHT_COL} not found in {path_data_train}")
+                    sample_weight = df.pop(TRAIN_WEIGHT_COL).to_numpy()
+                X, y, err = model_definition.data_preparation(df)
+                if err:
+                    raise ValueError(f"Train data structure is not aligned with the model requirements. {err}")
+                train_metrics = model.partial_fit(X, y, sample_weight=sample_weight)
+            if train_metrics is None:
+                raise ValueError(f"Train data set {path_data_train} is empty")
+        except Exception as ex:
+            logs.send(f"Cannot train the model chunk by chunk. Error:\n{ex}",
+                      lineno=logs.get_line(),
+                      kill=True)
+    elif path_warm_start is None:
+        logs.send("Start model training", is_error=False)
+        train_metrics = model.train(X, y, sample_weight=sample_weight, **stopping)
+    else:
+        logs.send(f"Start model training from {path_warm_start} with the options {WARM_START_OPTIONS}",
+                  is_error=False)
+        try:
+            train_metrics = model.warm_start(X, y, path_warm_start, sample_weight=sample_weight,
+                                             **stopping, **WARM_START_OPTIONS)
+        except Exception as ex:
+            logs.send(f"Cannot continue training the model {path_warm_start}. Error:\n{ex}",
+                      lineno=logs.get_line(),
+                      kill=True)
     t = round(time.time() - t0, 2)
     logs.send(f"Training completed. Elapsed time {t} sec. Model score:\n{train_metrics}", 
               is_error=False, webhook=True)
+    train_report = getattr(model, "train_report", None) or {}
+    if "unique_rows" in train_report and TRAIN_DEDUP:
+        logs.send(f"Deduplication: {train_report['rows']} rows collapsed into {train_report['unique_rows']} "
+                  f"unique rows, compression ratio {train_report['rows'] / max(train_report['unique_rows'], 1):.2f}",
+                  is_error=False)
+    if "trees" in train_report:
+        trees_new = train_report["trees"] - train_report["init_trees"]
+        logs.send(f"Boosting rounds: trained {train_report['rounds']} of {train_report['n_estimators']}, "
+                  f"kept {trees_new} new trees of {train_report['trees']} trees, "
+                  f"saved {train_report['n_estimators'] - trees_new} rounds. "
+                  f"Best iteration: {train_report['best_iteration']}",
+                  is_error=False)
 
-    # load data set to evaluate the model
-    if path_data_eval is not None:
-        df_eval, err = load_data(path_data_eval)
-        if err:
-            logs.send(f"Cannot read eval data from {path_data_eval}."
-                      f"Evaluation to be done using train data set. Error:\n{err}",
-                      lineno=logs.get_line(),
-                      kill=False)
-        # model score on evaluation data set
-        X_eval, y_eval, err = model_definition.data_preparation(df_eval)
-        if err:
-            logs.send(f"Eval data set cannot be processed. Error:\n{err}",
+    # model score on evaluation data set
+    if eval_set is not None:
+        y_eval_pred = model.predict(X_eval)
+        eval_metrics = model.score(y_eval, y_eval_pred)
+        logs.send(f"Model score on eval data set:\n{eval_metrics}",
+                  is_error=False, webhook=True)
+
+    # full retrain to decide if the warm started model needs to be rebuilt
+    if path_warm_start is not None and WARM_START_COMPARE and TRAIN_CHUNK_ROWS == 0:
+        model_full = model_definition.Model(dedup=TRAIN_DEDUP)
+        model_full.set_threads(nthread=threads["threads"], n_jobs=threads["threads"])
+        t0 = time.time()
+        train_metrics_full = model_full.train(X, y, sample_weight=sample_weight, **stopping)
+        t_full = round(time.time() - t0, 2)
+        comparison = f"Warm start vs full retrain: elapsed time {t} vs {t_full} sec, " \
+                     f"train {train_metrics} vs {train_metrics_full}"
+        if eval_set is not None:
+            comparison += f", eval {eval_metrics} vs {model_full.score(y_eval, model_full.predict(X_eval))}"
+        logs.send(comparison, is_error=False, webhook=True)
+
+    # build the predictions lookup table
+    if TRAIN_TABULATE:
+        if TRAIN_CHUNK_ROWS > 0:
+            logs.send("Predictions lookup table is not built for the model trained chunk by chunk",
                       lineno=logs.get_line())
         else:
-            y_eval_pred = model.predict(X_eval)
-            eval_metrics = model.score(y_eval, y_eval_pred)
-            logs.send(f"Model score on eval data set:\n{eval_metrics}",
-                      is_error=False, webhook=True)
+            try:
+                table_report = model.tabulate(X_tabulate if eval_set is None
+                                              else pd.concat([X_tabulate, X_eval]))
+                logs.send(f"Predictions lookup table: {table_report['entries']} distinct features vectors",
+                          is_error=False)
+            except Exception as ex:
+                logs.send(f"Cannot build the predictions lookup table, the model is saved without it. Error:\n{ex}",
+                          lineno=logs.get_line())
     # save the model
     path_model = os.path.join(BUCKET_MODEL, PREFIX_MODEL)
     if not os.path.isdir(path_model):
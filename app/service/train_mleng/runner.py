@@ -8,6 +8,7 @@ import numpy as np
 from google.cloud import storage
 from service_pkg.logger import getLogger
 from service_pkg.file_io import load_data
+from service_pkg.threads import set_threads
 import importlib
 from pathlib import Path
 
@@ -63,6 +64,21 @@ BUCKET_CONFIG = os.getenv("BUCKET_CONFIG", "/config")
 
 BUCKET_MODEL = os.getenv("BUCKET_MODEL", "/model")
 
+# data schema name to load the data with compact dtypes, see service_pkg.file_io.SCHEMAS
+DATA_SCHEMA = os.getenv("DATA_SCHEMA") or None
+# data format of the train and eval files: csv, parquet, feather; defined by the files extensions by default
+DATA_FORMAT = os.getenv("DATA_FORMAT") or None
+
+# hyperparameters search options, the exhaustive grid search is run by default
+# strategy: grid, random, halving; resource of the successive halving: n_samples, n_estimators
+SEARCH_OPTIONS = {k: v for k, v in {
+    "strategy": os.getenv("SEARCH_STRATEGY"),
+    "n_candidates": int(os.getenv("SEARCH_CANDIDATES", 0)),
+    "resource": os.getenv("SEARCH_RESOURCE"),
+    "early_stopping_rounds": int(os.getenv("SEARCH_EARLY_STOPPING_ROUNDS", 0)),
+    "journal": os.getenv("SEARCH_JOURNAL")
+}.items() if v}
+
 
 def is_gs_bucket(bucket: str) -> Tuple[bool, str]:
     """Function to check if the bucket exists
@@ -121,6 +137,15 @@ if __name__ == "__main__":
     
     logs = getLogger(f"service/train-mleng/{MODEL_VERSION}",
                      webhook_url=WEBHOOK_URL)
+
+    # limit the threads pools to the CPUs available to the container
+    try:
+        threads = set_threads()
+    except ValueError as ex:
+        logs.send(f"Cannot define the threading configuration. Error:\n{ex}",
+                  lineno=logs.get_line(),
+                  kill=True)
+    logs.send(f"Threading configuration: {threads}", is_error=False)
     
     PATH_DATA = args.train_path
     PATH_EVAL = args.eval_path
@@ -170,8 +195,10 @@ if __name__ == "__main__":
                 kill=False)
 
     # download the train data set
+    # the local file keeps the object name to preserve the data format extension
+    path_train_local = os.path.join("/tmp", f"train_{os.path.basename(PATH_DATA)}")
     try:
-      with open("/tmp/data.csv.gz", 'wb') as f:
+      with open(path_train_local, 'wb') as f:
         gs.get_bucket(BUCKET_DATA)\
             .get_blob(PATH_DATA)\
             .download_to_file(f)
@@ -180,7 +207,7 @@ if __name__ == "__main__":
                 lineno=logs.get_line(),
                 kill=True)
       
-    df_train, err = load_data("/tmp/data.csv.gz")
+    df_train, err = load_data(path_train_local, schema=DATA_SCHEMA, data_format=DATA_FORMAT)
     if err:
       logs.send(f"Cannot read train data set.\nError: {err}",
                 lineno=logs.get_line(),
@@ -195,6 +222,8 @@ if __name__ == "__main__":
     
     # instantiate a model class object
     model = model_pkg.Model()
+    # the grid search runs one single-threaded candidate per CPU
+    model.set_threads(nthread=threads["threads"], n_jobs=threads["threads"])
     
     # read the config in case it's provided
     t0 = time.time()
@@ -220,9 +249,20 @@ if __name__ == "__main__":
                   lineno=logs.get_line(),
                   kill=True)
       
-      metrics_train = model.grid_search(X=X,
-                                        y=y,
-                                        config=config)
+      try:
+        metrics_train = model.grid_search(X=X,
+                                          y=y,
+                                          config=config,
+                                          **SEARCH_OPTIONS)
+      except Exception as ex:
+        logs.send(f"Grid search with the options {SEARCH_OPTIONS} failed. Error:\n{ex}",
+                  lineno=logs.get_line(),
+                  kill=True)
+
+      if getattr(model, "search_report", None):
+        logs.send(f"Search report: {model.search_report}",
+                  is_error=False,
+                  kill=False)
   
     t = round(time.time() - t0, 2)
     logs.send(f"Training completed. Elapsed time: {t} sec.\nModel performance: {metrics_train}",
@@ -254,9 +294,10 @@ if __name__ == "__main__":
     
     # evaluate model
     if flag_eval:
-      # download the train data set
+      # download the eval data set
+      path_eval_local = os.path.join("/tmp", f"eval_{os.path.basename(PATH_EVAL)}")
       try:
-        with open("/tmp/data.csv.gz", 'wb') as f:
+        with open(path_eval_local, 'wb') as f:
           gs.get_bucket(BUCKET_DATA)\
               .get_blob(PATH_EVAL)\
               .download_to_file(f)
@@ -266,7 +307,7 @@ if __name__ == "__main__":
                   is_error=False,
                   kill=True)
 
-      df_eval, err = load_data("/tmp/data.csv.gz")
+      df_eval, err = load_data(path_eval_local, schema=DATA_SCHEMA, data_format=DATA_FORMAT)
       if err:
         logs.send(f"Cannot read eval data set.\nError: {err}",
                   lineno=logs.get_line(),
@@ -16,7 +16,7 @@ export BUCKET_DATA_TRAIN=${BASE_DIR}/bucket/data/train/${DATA_VER}
 export PATH_TRAIN=${PREFIX}/train.csv.gz
 export PATH_EVAL=${PREFIX}/eval.csv.gz
 # serve service
-export PATH_MODEL=${MODEL_VER}/${PREFIX}/model.pkl
+export PATH_MODEL=${MODEL_VER}/${PREFIX}/model.json
 export BUCKET_DATA_PREDICT=${BASE_DIR}/bucket/data/predict
 export PATH_DATA_IN=input/${DATA_VER}/${PREFIX}/prediction_input.csv.gz
 export PATH_DATA_OUT=output/${DATA_VER}/${PREFIX}/prediction_output.csv.gz
\ No newline at end of file